@@ -1,20 +1,296 @@
 import os
 import re
+import math
+import io
+import sys
+import copy
+import array
 import json
 import uuid
-from flask import Flask, render_template, request, send_file, jsonify, session
+import fcntl
+import shutil
+import hashlib
+import functools
+import contextlib
+import zipfile
+import multiprocessing
+from flask import Flask, render_template, request, send_file, jsonify, session, Response, stream_with_context
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.middleware.proxy_fix import ProxyFix
+from urllib.parse import quote
 import subprocess
 import tempfile
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, TIT2, TPE1, TALB, TCON, TRCK, TDRC, COMM, ID3NoHeaderError
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 app = Flask(__name__)
 app.secret_key = 'video-converter-secret-key-2024'
 
+# Reverse proxies in front of the app (Render has one) - needed to see real client IPs
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+
 # Configure upload folder - use system temp directory for cleaner handling
 UPLOAD_FOLDER = tempfile.gettempdir()
 
+# Conversion jobs run in a pool of worker processes; their state lives on disk
+# so any gunicorn worker can answer status requests
+JOBS_FOLDER = os.path.join(UPLOAD_FOLDER, 'converter_jobs')
+os.makedirs(JOBS_FOLDER, exist_ok=True)
+MAX_WORKERS = int(os.environ.get('CONVERT_WORKERS', os.cpu_count() or 2))
+_executor = None
+_executor_pid = None
+_janitor_pid = None
+# Live progress is written into the job record at most every PROGRESS_INTERVAL seconds
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', 0.5))
+# Longest a progress stream or batch ZIP waits on its jobs before giving up (seconds)
+JOB_WAIT_TIMEOUT = int(os.environ.get('JOB_WAIT_TIMEOUT', 3600))
+# Progress streams and batch ZIPs each hold a request thread for as long as they run. At most
+# MAX_STREAMS of them run at once in each web worker, so its other threads (gunicorn.conf.py)
+# stay free for ordinary requests; more get a 429.
+MAX_STREAMS = int(os.environ.get('MAX_STREAMS', 4))
+_stream_slots = threading.BoundedSemaphore(max(MAX_STREAMS, 1))
+_progress = threading.local()
+
+# Admission control. Work is measured in units of roughly one minute of media,
+# weighted by output format. Each client IP has a token bucket of RATE_LIMIT_BURST
+# units refilled at RATE_LIMIT_PER_MINUTE (0 disables rate limiting).
+RATE_LIMIT_PER_MINUTE = float(os.environ.get('RATE_LIMIT_PER_MINUTE', 30))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', 60))
+# Relative cost of a minute of output (trimmed video is re-encoded with libx264);
+# previews and waveforms ride along on another output's decode
+FORMAT_COST = {'mp3': 1, 'm4a': 1, 'mp4': 4, 'preview': 0.5, 'peaks': 0.25}
+# Assumed length when it isn't known up front, and the cost of an info lookup
+DEFAULT_JOB_MINUTES = 5
+INFO_REQUEST_COST = 0.5
+# Queued work (per process) above which new jobs get a 429, and the Retry-After sent
+MAX_QUEUED_COST = float(os.environ.get('MAX_QUEUED_COST', 300))
+BUSY_RETRY_AFTER = int(os.environ.get('BUSY_RETRY_AFTER', 30))
+# Cheaper jobs run first; every PRIORITY_AGING seconds of waiting takes one unit off
+# a job's cost so long jobs still get their turn
+PRIORITY_AGING = float(os.environ.get('PRIORITY_AGING', 10))
+# Concurrent downloads and encodes across all processes (file-lock slots)
+ADMISSION_FOLDER = os.path.join(UPLOAD_FOLDER, 'converter_admission')
+os.makedirs(ADMISSION_FOLDER, exist_ok=True)
+RATE_FILE = os.path.join(ADMISSION_FOLDER, 'rate_limits.json')
+WORK_SLOTS = {
+    'download': int(os.environ.get('MAX_DOWNLOADS', 4)),
+    'encode': int(os.environ.get('MAX_ENCODES', os.cpu_count() or 2)),
+}
+_pending_jobs = []
+_running_jobs = 0
+_scheduler_lock = threading.RLock()
+# The queue above lives only in this process. Each process that queues jobs holds an owner lock
+# for as long as it lives, and whoever runs a job holds that job's lock - a queued or running job
+# whose lock is free has no process left to finish it.
+_job_owner = None
+
+# Every job gets its own scratch directory for downloads, uploads and results,
+# removed once the result has been sent (or the job fails)
+SCRATCH_FOLDER = os.path.join(UPLOAD_FOLDER, 'converter_scratch')
+os.makedirs(SCRATCH_FOLDER, exist_ok=True)
+# The janitor runs every JANITOR_INTERVAL seconds and removes scratch directories
+# older than SCRATCH_MAX_AGE and job records older than JOB_RECORD_MAX_AGE
+JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', 300))
+SCRATCH_MAX_AGE = int(os.environ.get('SCRATCH_MAX_AGE', 3600))
+JOB_RECORD_MAX_AGE = int(os.environ.get('JOB_RECORD_MAX_AGE', 24 * 3600))
+# Temp files that older versions (and crashed runs) left directly in UPLOAD_FOLDER
+ORPHAN_PREFIXES = ('upload_', 'work_', 'result_', 'temp_audio_', 'temp_video_')
+# New jobs are refused while the temp filesystem is fuller than this fraction
+DISK_HIGH_WATER = float(os.environ.get('DISK_HIGH_WATER', 0.9))
+# Finished results are kept for RESULT_TTL seconds so an interrupted download can be
+# resumed (HTTP Range) or repeated, then the janitor removes them
+RESULTS_FOLDER = os.path.join(UPLOAD_FOLDER, 'converter_results')
+os.makedirs(RESULTS_FOLDER, exist_ok=True)
+RESULT_TTL = int(os.environ.get('RESULT_TTL', 1800))
+# Resumable uploads live in a scratch directory (idle ones expire with SCRATCH_MAX_AGE)
+# and are sent in ranged PUTs of this size
+RESUMABLE_CHUNK_SIZE = int(os.environ.get('RESUMABLE_CHUNK_MB', 4)) * 1024 * 1024
+
+# Finished outputs are cached on disk, keyed by source identity and conversion settings
+# Two tiers: 'source' holds untouched downloads, 'result' holds finished outputs
+CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, 'converter_cache')
+CACHE_TIERS = {
+    'source': {
+        'folder': os.path.join(CACHE_FOLDER, 'sources'),
+        'max_bytes': int(os.environ.get('SOURCE_CACHE_MB', 4096)) * 1024 * 1024,
+    },
+    'result': {
+        'folder': os.path.join(CACHE_FOLDER, 'results'),
+        'max_bytes': int(os.environ.get('RESULT_CACHE_MB', 2048)) * 1024 * 1024,
+    },
+}
+for _tier in CACHE_TIERS.values():
+    os.makedirs(_tier['folder'], exist_ok=True)
+STATS_FILE = os.path.join(CACHE_FOLDER, 'stats.json')
+# Histogram buckets (seconds) for per-stage timings on /metrics
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Extracted video info is reused for INFO_CACHE_TTL seconds, so /convert right
+# after /fetch-info doesn't extract again
+INFO_CACHE_FOLDER = os.path.join(CACHE_FOLDER, 'info')
+os.makedirs(INFO_CACHE_FOLDER, exist_ok=True)
+INFO_CACHE_TTL = int(os.environ.get('INFO_CACHE_TTL', 3600))
+# Batch info requests: concurrent extractions and max URLs per request
+INFO_WORKERS = int(os.environ.get('INFO_WORKERS', 4))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+
+# Uploads in these containers can be decoded from a pipe as they arrive;
+# MP4-family files only when the moov atom comes first
+STREAMABLE_EXTENSIONS = {'mp3', 'aac', 'ogg', 'oga', 'opus', 'flac', 'wav', 'webm', 'mkv', 'mka', 'ts', 'flv'}
+MP4_EXTENSIONS = {'mp4', 'm4a', 'm4v', 'mov', '3gp'}
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# ffmpeg metadata names for our ID3 fields (used when tagging a live stream)
+FFMPEG_METADATA_KEYS = {
+    'title': 'title',
+    'artist': 'artist',
+    'album': 'album',
+    'album_artist': 'album_artist',
+    'genre': 'genre',
+    'track': 'track',
+    'year': 'date',
+    'comment': 'comment',
+}
+# ID3 frames for the same fields
+ID3_FRAMES = {
+    'title': 'TIT2',
+    'artist': 'TPE1',
+    'album': 'TALB',
+    'album_artist': 'TPE2',
+    'genre': 'TCON',
+    'track': 'TRCK',
+    'year': 'TDRC',
+    'comment': 'COMM',
+}
+# Spare room left in every ID3 tag we write, so later tag edits rewrite only the tag
+# instead of moving the whole file
+ID3_PADDING = int(os.environ.get('ID3_PADDING_KB', 16)) * 1024
+# Cover art made from video thumbnails is scaled down to fit in this many pixels square
+COVER_ART_SIZE = 600
+
+# ffmpeg errors that mean the input can never be converted, so the fallback isn't tried
+FFMPEG_INPUT_ERRORS = (
+    'Invalid data found when processing input',
+    'does not contain any stream',
+    'matches no streams',
+    'moov atom not found',
+    'No such file or directory',
+    'Permission denied',
+)
+# The fallback path decodes to PCM at this rate and relays it in chunks of this size
+FALLBACK_SAMPLE_RATE = 44100
+FALLBACK_CHUNK_SIZE = 64 * 1024
+
+# yt-dlp options shared by every extraction - browser-like headers and player
+# clients that avoid most 403s and bot checks
+YDL_BASE_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'noplaylist': True,
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-us,en;q=0.5',
+    },
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['android', 'web'],
+        }
+    },
+}
+# What each kind of extraction adds on top; pooled YoutubeDL instances are built per profile
+YDL_PROFILES = {
+    'info': {'extract_flat': False},
+    'audio': {'format': 'bestaudio/best'},
+    'video': {'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best', 'merge_output_format': 'mp4'},
+}
+# Download tuning: HLS/DASH fragments fetched FRAGMENT_THREADS at a time, and optionally
+# an external downloader (e.g. aria2c) for plain HTTP(S) files, which opens
+# EXTERNAL_DOWNLOADER_CONNECTIONS connections per file
+FRAGMENT_THREADS = int(os.environ.get('FRAGMENT_THREADS', 4))
+EXTERNAL_DOWNLOADER = os.environ.get('EXTERNAL_DOWNLOADER', '').strip()
+EXTERNAL_DOWNLOADER_CONNECTIONS = int(os.environ.get('EXTERNAL_DOWNLOADER_CONNECTIONS', 8))
+if EXTERNAL_DOWNLOADER and not shutil.which(EXTERNAL_DOWNLOADER):
+    app.logger.warning(f"EXTERNAL_DOWNLOADER {EXTERNAL_DOWNLOADER} not found - using yt-dlp's own downloader")
+    EXTERNAL_DOWNLOADER = ''
+# Idle YoutubeDL instances kept per profile in each process (building one costs ~70ms)
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', 4))
+_ydl_pool = {}
+_ydl_pool_pid = None
+_ydl_pool_lock = threading.Lock()
+
+# Download only the trim window when the full source isn't cached yet
+RANGE_DOWNLOADS = os.environ.get('RANGE_DOWNLOADS', '1') == '1'
+
+# Output formats: file extension, MIME type, what to download for URL input,
+# and the audio codec/container that can be passed through without re-encoding
+OUTPUT_FORMATS = {
+    'mp3': {'ext': 'mp3', 'mimetype': 'audio/mpeg', 'media': 'audio', 'codec': 'mp3', 'container': 'mp3'},
+    'm4a': {'ext': 'm4a', 'mimetype': 'audio/mp4', 'media': 'audio', 'codec': 'aac', 'container': 'm4a'},
+    'mp4': {'ext': 'mp4', 'mimetype': 'video/mp4', 'media': 'video'},
+}
+# Extra outputs a multi-output job can ask for: a short MP3 preview clip and a
+# waveform overview (audiowaveform-style JSON peaks)
+EXTRA_OUTPUTS = {
+    'preview': {'ext': 'mp3', 'mimetype': 'audio/mpeg', 'media': 'audio'},
+    'peaks': {'ext': 'json', 'mimetype': 'application/json', 'media': 'audio'},
+}
+# Multi-output jobs: most outputs per job, bitrates an MP3/M4A output may ask for,
+# preview length, and the waveform's decode rate and number of points
+MAX_OUTPUTS = 8
+OUTPUT_BITRATES = ['64k', '96k', '128k', '160k', '192k', '256k', '320k']
+PREVIEW_SECONDS = int(os.environ.get('PREVIEW_SECONDS', 30))
+PEAKS_SAMPLE_RATE = 8000
+PEAKS_POINTS = 1000
+
+# Encoder presets trade CPU for quality. Each maps to MP3 rate control, libx264
+# speed/quality, AAC bitrate and ffmpeg thread count; 'audio_copy' allows copying
+# the audio stream as-is when the source is already in the target codec.
+# The preset is part of every result cache key.
+ENCODER_PRESETS = {
+    'fast': {
+        'mp3': ['-b:a', '128k'],
+        'x264': ['-preset', 'veryfast', '-crf', '26'],
+        'aac': ['-b:a', '128k'],
+        'threads': '1',
+        'audio_copy': True,
+    },
+    'balanced': {
+        'mp3': ['-q:a', '2'],
+        'x264': ['-preset', 'medium', '-crf', '23'],
+        'aac': ['-b:a', '160k'],
+        'threads': '2',
+        'audio_copy': True,
+    },
+    'archival': {
+        'mp3': ['-b:a', '320k'],
+        'x264': ['-preset', 'slow', '-crf', '18'],
+        'aac': ['-b:a', '256k'],
+        'threads': '0',
+        'audio_copy': False,
+    },
+}
+# How the quality picker on the page names each preset
+PRESET_LABELS = {
+    'fast': 'Fast - smaller files, quickest',
+    'balanced': 'Balanced',
+    'archival': 'Archival - best quality, slowest',
+}
+DEFAULT_PRESET = os.environ.get('ENCODER_PRESET', 'balanced')
+# Presets clients may pick with the 'preset' form field
+ALLOWED_PRESETS = [p.strip() for p in os.environ.get('ALLOWED_PRESETS', ','.join(ENCODER_PRESETS)).split(',') if p.strip()]
+for preset_name in ALLOWED_PRESETS + [DEFAULT_PRESET]:
+    if preset_name not in ENCODER_PRESETS:
+        raise Exception(f"Unknown encoder preset '{preset_name}' in ENCODER_PRESET/ALLOWED_PRESETS. Choose from: {', '.join(ENCODER_PRESETS)}")
+if DEFAULT_PRESET not in ALLOWED_PRESETS:
+    # Requests without a 'preset' field get the default, so it must be one clients may use
+    raise Exception(f"ENCODER_PRESET '{DEFAULT_PRESET}' is not in ALLOWED_PRESETS ({', '.join(ALLOWED_PRESETS)})")
+
 def parse_time_to_seconds(time_str):
     """Convert HH:MM:SS or MM:SS or SS to seconds"""
     if not time_str or time_str.strip() == '':
@@ -49,132 +325,327 @@ def sanitize_filename(title):
     clean = re.sub(r'[-\s]+', '_', clean)
     return clean[:50]  # Limit length
 
-def get_video_info(url):
-    """Fetch video information without downloading"""
+def download_ydl_options():
+    """yt-dlp options that speed up the download itself (FRAGMENT_THREADS, EXTERNAL_DOWNLOADER)"""
+    ydl_opts = {'concurrent_fragment_downloads': max(FRAGMENT_THREADS, 1)}
+    if EXTERNAL_DOWNLOADER:
+        # Only for single-file HTTP(S) formats - fragmented ones use the threads above
+        ydl_opts['external_downloader'] = {'http': EXTERNAL_DOWNLOADER}
+        if os.path.basename(EXTERNAL_DOWNLOADER) == 'aria2c':
+            connections = str(max(EXTERNAL_DOWNLOADER_CONNECTIONS, 1))
+            ydl_opts['external_downloader_args'] = {
+                'aria2c': ['--max-connection-per-server', connections, '--split', connections,
+                           '--min-split-size', '1M', '--summary-interval', '0'],
+            }
+    return ydl_opts
+
+def ydl_options(profile='info', **overrides):
+    """yt-dlp options for a profile ('info', 'audio' or 'video') plus any overrides"""
+    ydl_opts = copy.deepcopy(YDL_BASE_OPTS)
+    ydl_opts.update(YDL_PROFILES[profile])
+    if profile != 'info':
+        ydl_opts.update(download_ydl_options())
+    ydl_opts.update(overrides)
+    return ydl_opts
+
+@contextlib.contextmanager
+def pooled_ydl(profile, **params):
+    """A ready-built YoutubeDL for a profile from this process's pool. Per-call params
+    (outtmpl, download_ranges, ...) apply only for the duration of the block.
+    Instances keep their HTTP session, so jobs in the same process reuse
+    keep-alive connections to the same sites and CDNs."""
+    global _ydl_pool_pid
     import yt_dlp
     
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'extract_flat': False,
-        'noplaylist': True,
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        },
-        'extractor_args': {
-            'youtube': {
-                'player_client': ['android', 'web'],
-            }
-        },
-    }
+    with _ydl_pool_lock:
+        if _ydl_pool_pid != os.getpid():
+            # Forked - don't share the parent's instances or their open connections
+            _ydl_pool.clear()
+            _ydl_pool_pid = os.getpid()
+        idle = _ydl_pool.setdefault(profile, [])
+        ydl = idle.pop() if idle else None
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(ydl_options(profile))
     
+    missing = object()
+    saved = {key: ydl.params.get(key, missing) for key in params}
+    ydl.params.update(params)
+    if 'outtmpl' in params:
+        # yt-dlp keeps output templates as a dict by type
+        ydl.params['outtmpl'] = dict(saved['outtmpl'], default=params['outtmpl'])
+    # yt-dlp also runs progress hooks on its fragment download threads, which can't see this
+    # thread's reporter - so the hook carries the reporter itself
+    ydl._progress_hooks = [functools.partial(download_progress_hook, current_progress())]
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # Try to extract artist from uploader or channel
-            artist = info.get('artist', '') or info.get('uploader', '') or info.get('channel', '')
-            
-            # Try to parse title for artist - title format (common in music videos)
-            title = info.get('title', '')
-            if ' - ' in title and not info.get('artist'):
-                parts = title.split(' - ', 1)
-                artist = parts[0].strip()
-                title = parts[1].strip()
-            
-            return {
-                'title': title,
-                'artist': artist,
-                'album': info.get('album', ''),
-                'duration': info.get('duration', 0),
-                'duration_formatted': format_duration(info.get('duration', 0)),
-                'thumbnail': info.get('thumbnail', ''),
-                'uploader': info.get('uploader', ''),
-                'upload_date': info.get('upload_date', ''),
-                'year': info.get('upload_date', '')[:4] if info.get('upload_date') else '',
-            }
+        yield ydl
+    except BaseException:
+        # Don't hand an instance that failed mid-run to the next request
+        ydl.close()
+        raise
+    
+    for key, value in saved.items():
+        if value is missing:
+            ydl.params.pop(key, None)
+        else:
+            ydl.params[key] = value
+    ydl._progress_hooks = []
+    with _ydl_pool_lock:
+        idle = _ydl_pool.setdefault(profile, [])
+        if _ydl_pool_pid == os.getpid() and len(idle) < YDL_POOL_SIZE:
+            idle.append(ydl)
+            return
+    ydl.close()
+
+def warm_up():
+    """Pay yt-dlp's one-off costs up front (run in each gunicorn worker after it forks):
+    import it, compile every extractor's URL pattern and fill the YoutubeDL pool.
+    Returns (phase, seconds) pairs for the startup log."""
+    timings = []
+    started = time.perf_counter()
+    import yt_dlp
+    timings.append(('import yt-dlp', time.perf_counter() - started))
+    
+    started = time.perf_counter()
+    canonical_video_id('https://example.com/warm-up')
+    timings.append(('extractors', time.perf_counter() - started))
+    
+    started = time.perf_counter()
+    for profile in YDL_PROFILES:
+        with pooled_ydl(profile):
+            pass
+    timings.append(('YoutubeDL pool', time.perf_counter() - started))
+    return timings
+
+def info_cache_path(url):
+    """Info cache file for a URL - one per canonical video ID"""
+    key = hashlib.sha256(canonical_video_id(url).encode()).hexdigest()
+    return os.path.join(INFO_CACHE_FOLDER, f"{key}.json")
+
+def cached_video_info(url):
+    """Previously extracted yt-dlp info for a URL if it is still fresh, else None (never hits the network)"""
+    path = info_cache_path(url)
+    try:
+        if time.time() - os.path.getmtime(path) < INFO_CACHE_TTL:
+            with open(path) as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+    return None
+
+def fresh_info_entries():
+    """Number of info cache entries that are still within INFO_CACHE_TTL"""
+    now = time.time()
+    count = 0
+    for entry in os.scandir(INFO_CACHE_FOLDER):
+        try:
+            if entry.name.endswith('.json') and now - entry.stat().st_mtime < INFO_CACHE_TTL:
+                count += 1
+        except OSError:
+            pass
+    return count
+
+def extract_video_info(url):
+    """Full yt-dlp info dict for a URL, served from the TTL cache when possible"""
+    info = cached_video_info(url)
+    if info is not None:
+        increment_stat('info_cache_hits')
+        return info
+    increment_stat('info_cache_misses')
+    
+    with timed_stage('info'), pooled_ydl('info') as ydl:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    
+    path = info_cache_path(url)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(info, f)
+    os.replace(tmp_path, path)
+    return info
+
+def run_extraction(ydl, url, download):
+    """extract_info on an open YoutubeDL, replaying cached info instead of re-extracting when available"""
+    info = cached_video_info(url)
+    if info is not None:
+        try:
+            return ydl.process_ie_result(info, download=download)
+        except Exception:
+            # Cached media URLs may have expired - extract afresh
+            pass
+    return ydl.extract_info(url, download=download)
+
+def get_video_info(url):
+    """Fetch video information without downloading"""
+    try:
+        info = extract_video_info(url)
+        
+        # Try to extract artist from uploader or channel
+        artist = info.get('artist', '') or info.get('uploader', '') or info.get('channel', '')
+        
+        # Try to parse title for artist - title format (common in music videos)
+        title = info.get('title', '')
+        if ' - ' in title and not info.get('artist'):
+            parts = title.split(' - ', 1)
+            artist = parts[0].strip()
+            title = parts[1].strip()
+        
+        return {
+            'title': title,
+            'artist': artist,
+            'album': info.get('album', ''),
+            'duration': info.get('duration', 0),
+            'duration_formatted': format_duration(info.get('duration', 0)),
+            'thumbnail': info.get('thumbnail', ''),
+            'uploader': info.get('uploader', ''),
+            'upload_date': info.get('upload_date', ''),
+            'year': info.get('upload_date', '')[:4] if info.get('upload_date') else '',
+        }
     except Exception as e:
         raise Exception(f"Failed to fetch video info: {str(e)}")
 
-def download_video_audio(url, output_dir):
-    """Download audio from any supported site using yt-dlp Python library"""
+def list_playlist_urls(url):
+    """Entry URLs and title of a playlist, via a flat extraction that doesn't resolve each entry"""
+    import yt_dlp
+    
+    ydl_opts = ydl_options('info', extract_flat='in_playlist', noplaylist=False, playlistend=BATCH_MAX_ITEMS)
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    
+    if not info.get('entries'):
+        # Not a playlist - just the one video
+        return [url], None
+    urls = [entry.get('url') or entry.get('webpage_url') for entry in info['entries']
+            if entry and (entry.get('url') or entry.get('webpage_url'))]
+    return urls, info.get('title')
+
+def get_video_infos(urls):
+    """get_video_info for many URLs concurrently, with bounded parallelism"""
+    def fetch(url):
+        try:
+            return {'url': url, 'info': get_video_info(url)}
+        except Exception as e:
+            return {'url': url, 'error': str(e)}
+    
+    with ThreadPoolExecutor(max_workers=INFO_WORKERS) as pool:
+        return list(pool.map(fetch, urls))
+
+class ProgressReporter:
+    """Collects a job's live progress and writes it into the job record (throttled)"""
+    
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.state = {}
+        self.last_write = 0
+        # yt-dlp's fragment threads report concurrently
+        self.lock = threading.Lock()
+    
+    def update(self, stage=None, **fields):
+        with self.lock:
+            self._update(stage, **fields)
+    
+    def _update(self, stage=None, **fields):
+        force = False
+        if stage and stage != self.state.get('stage'):
+            # New stage - drop the previous stage's numbers and report right away
+            self.state = {'stage': stage}
+            force = True
+        self.state.update(fields)
+        
+        now = time.time()
+        if force or now - self.last_write >= PROGRESS_INTERVAL:
+            self.last_write = now
+            update_job(self.job_id, progress=dict(self.state))
+
+def set_progress_reporter(reporter):
+    """Send progress from this thread to a ProgressReporter (None to stop)"""
+    _progress.reporter = reporter
+
+def current_progress():
+    """This thread's ProgressReporter, or None when no job is listening"""
+    return getattr(_progress, 'reporter', None)
+
+def report_progress(stage=None, **fields):
+    """Report progress for the job running in this thread, if any"""
+    reporter = current_progress()
+    if reporter is not None:
+        reporter.update(stage, **fields)
+
+def download_progress_hook(reporter, status):
+    """yt-dlp progress hook - reports bytes downloaded, speed and ETA to a job's reporter"""
+    if reporter is not None and status.get('status') in ('downloading', 'finished'):
+        reporter.update(
+            'downloading',
+            downloaded_bytes=status.get('downloaded_bytes'),
+            total_bytes=status.get('total_bytes') or status.get('total_bytes_estimate'),
+            download_speed=status.get('speed'),
+            eta=status.get('eta'),
+        )
+
+def acquire_slot(kind, wait=True):
+    """Take one of the 'download' or 'encode' slots shared by every process.
+    Returns the held lock file (close it to release), or None if all are busy and wait is False."""
+    reported = False
+    while True:
+        for index in range(WORK_SLOTS[kind]):
+            handle = open(os.path.join(ADMISSION_FOLDER, f"{kind}.{index}.lock"), 'a')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return handle
+            except BlockingIOError:
+                handle.close()
+        if not wait:
+            return None
+        if not reported:
+            report_progress('waiting', waiting_for=kind)
+            reported = True
+        time.sleep(0.25)
+
+@contextlib.contextmanager
+def work_slot(kind):
+    """Hold a download/encode slot for the duration of a block, waiting for one if needed"""
+    handle = acquire_slot(kind)
+    try:
+        yield
+    finally:
+        handle.close()
+
+def download_video_audio(url, output_dir, start_time=None, end_time=None):
+    """Download the best audio stream as-is (no re-encode) using yt-dlp Python library.
+    If start/end are given only that window is fetched."""
     import yt_dlp
     
     try:
         # Generate a unique temp filename
         temp_base = os.path.join(output_dir, f"temp_audio_{uuid.uuid4().hex[:8]}")
         
-        # Configure yt-dlp options with better settings to avoid blocks
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'outtmpl': f'{temp_base}.%(ext)s',
-            'noplaylist': True,
-            'quiet': True,
-            'no_warnings': True,
-            # Better headers to avoid 403 errors
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-            },
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web'],
-                }
-            },
-        }
+        # No FFmpegExtractAudio postprocessor - the pristine stream is kept so
+        # every trim/format is encoded once, straight from the source.
+        ydl_params = {'outtmpl': f'{temp_base}.%(ext)s'}
+        
+        # When trimming, fetch only the requested window instead of the whole file
+        if start_time is not None or end_time is not None:
+            ydl_params['download_ranges'] = yt_dlp.utils.download_range_func(
+                None, [(start_time or 0, end_time if end_time is not None else float('inf'))])
         
         title = "downloaded_audio"
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with work_slot('download'), timed_stage('download'), pooled_ydl('audio', **ydl_params) as ydl:
             # Extract info first to get title
-            info = ydl.extract_info(url, download=True)
+            info = run_extraction(ydl, url, download=True)
             if info:
                 title = info.get('title', 'downloaded_audio')
         
-        # Find the output file (prefer mp3)
-        output_file = f"{temp_base}.mp3"
-        non_mp3_file = None
-        
-        if not os.path.exists(output_file):
-            # Sometimes the extension differs - find what was actually downloaded
-            for ext in ['m4a', 'webm', 'opus', 'ogg', 'wav', 'mp3']:
-                check_file = f"{temp_base}.{ext}"
-                if os.path.exists(check_file):
-                    if ext == 'mp3':
-                        output_file = check_file
-                    else:
-                        non_mp3_file = check_file
-                    break
-        
-        # If we got a non-MP3 file, convert it to MP3
-        if non_mp3_file and not os.path.exists(output_file):
-            mp3_output = f"{temp_base}.mp3"
-            try:
-                # Convert to MP3 using ffmpeg
-                cmd = ['ffmpeg', '-y', '-i', non_mp3_file, '-vn', '-acodec', 'libmp3lame', '-q:a', '2', mp3_output]
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-                if result.returncode == 0 and os.path.exists(mp3_output):
-                    # Remove original non-mp3 file
-                    try:
-                        os.remove(non_mp3_file)
-                    except:
-                        pass
-                    output_file = mp3_output
-                else:
-                    # Fallback to the non-mp3 file if conversion fails
-                    output_file = non_mp3_file
-            except Exception:
-                output_file = non_mp3_file
+        # Find what was actually downloaded (extension depends on the source)
+        output_file = None
+        for ext in ['m4a', 'webm', 'opus', 'ogg', 'mp3', 'aac', 'wav', 'mp4']:
+            check_file = f"{temp_base}.{ext}"
+            if os.path.exists(check_file):
+                output_file = check_file
+                break
         
-        if not os.path.exists(output_file):
+        if not output_file:
             raise Exception("Download completed but output file not found")
         
+        increment_stat('bytes_in_download', os.path.getsize(output_file))
         return output_file, sanitize_filename(title)
         
     except Exception as e:
@@ -185,39 +656,28 @@ def download_video_audio(url, output_dir):
             raise Exception("This site requires sign-in. Try a different video or use file upload instead.")
         raise Exception(f"Download failed: {error_msg}")
 
-def download_video(url, output_dir):
-    """Download video as MP4 from any supported site using yt-dlp"""
+def download_video(url, output_dir, start_time=None, end_time=None):
+    """Download video as MP4 from any supported site using yt-dlp.
+    If start/end are given only that window is fetched."""
     import yt_dlp
     
     try:
         # Generate a unique temp filename
         temp_base = os.path.join(output_dir, f"temp_video_{uuid.uuid4().hex[:8]}")
         
-        # Configure yt-dlp options for video download
-        ydl_opts = {
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-            'outtmpl': f'{temp_base}.%(ext)s',
-            'noplaylist': True,
-            'quiet': True,
-            'no_warnings': True,
-            'merge_output_format': 'mp4',
-            # Better headers to avoid blocks
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-            },
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web'],
-                }
-            },
-        }
+        ydl_params = {'outtmpl': f'{temp_base}.%(ext)s'}
+        
+        # When trimming, fetch only the requested window instead of the whole file
+        if start_time is not None or end_time is not None:
+            ydl_params['download_ranges'] = yt_dlp.utils.download_range_func(
+                None, [(start_time or 0, end_time if end_time is not None else float('inf'))])
+            # Re-encode only the clip so the cut is frame accurate
+            ydl_params['force_keyframes_at_cuts'] = True
         
         title = "downloaded_video"
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
+        with work_slot('download'), timed_stage('download'), pooled_ydl('video', **ydl_params) as ydl:
+            info = run_extraction(ydl, url, download=True)
             if info:
                 title = info.get('title', 'downloaded_video')
         
@@ -248,6 +708,7 @@ def download_video(url, output_dir):
         if not os.path.exists(output_file):
             raise Exception("Download completed but output file not found")
         
+        increment_stat('bytes_in_download', os.path.getsize(output_file))
         return output_file, sanitize_filename(title)
         
     except Exception as e:
@@ -258,149 +719,598 @@ def download_video(url, output_dir):
             raise Exception("This site requires sign-in. Try a different video or use file upload instead.")
         raise Exception(f"Download failed: {error_msg}")
 
-def add_id3_tags(mp3_path, title=None, artist=None, album=None, genre=None, track=None, year=None, comment=None):
+def get_audio_stream_url(url):
+    """Resolve the direct media URL of the best audio stream so ffmpeg can read it without a download.
+    Returns (media_url, http_headers, title), or None if the format can't be read directly."""
+    with pooled_ydl('audio') as ydl:
+        info = run_extraction(ydl, url, download=False)
+    
+    if not info or info.get('protocol') not in ('http', 'https', 'm3u8', 'm3u8_native'):
+        return None
+    return info['url'], info.get('http_headers') or {}, sanitize_filename(info.get('title', 'downloaded_audio'))
+
+def id3_padding(info):
+    """mutagen padding policy - keep the padding a tag already has, so an edit that fits only
+    rewrites the tag, and leave ID3_PADDING spare whenever the tag has to grow"""
+    return info.padding if info.padding >= 0 else ID3_PADDING
+
+def apply_id3_fields(tags, fields, cover=None):
+    """Set tag fields on a mutagen ID3 object - non-empty values replace the frame, empty ones
+    remove it and missing ones are left alone. cover is {'data', 'mime'} front-cover art."""
+    from mutagen.id3 import Frames, COMM, APIC
+    
+    for key, value in fields.items():
+        if key not in ID3_FRAMES or value is None:
+            continue
+        frame_id = ID3_FRAMES[key]
+        tags.delall(frame_id)
+        value = str(value).strip()
+        if not value:
+            continue
+        if frame_id == 'COMM':
+            tags.add(COMM(encoding=3, lang='eng', desc='', text=value))
+        else:
+            tags.add(Frames[frame_id](encoding=3, text=value))
+    
+    if cover:
+        tags.delall('APIC')
+        tags.add(APIC(encoding=3, mime=cover['mime'], type=3, desc='Cover', data=cover['data']))
+
+def write_id3_tags(mp3_path, fields, cover=None):
+    """Update an MP3's ID3 tag in place (see apply_id3_fields). Only the tag at the start of
+    the file is rewritten as long as the change fits in its padding."""
+    from mutagen.id3 import ID3, ID3NoHeaderError
+    
+    try:
+        tags = ID3(mp3_path)
+    except ID3NoHeaderError:
+        tags = ID3()
+    apply_id3_fields(tags, fields, cover)
+    tags.save(mp3_path, padding=id3_padding)
+
+def copy_with_id3_tags(src_path, output_path, fields, cover=None):
+    """Write a tagged copy of an MP3 in one pass - the new tag (with ID3_PADDING spare) followed
+    by the source's audio - instead of copying the file and then growing its tag"""
+    from mutagen.id3 import ID3, ID3NoHeaderError
+    
+    try:
+        tags = ID3(src_path)
+        audio_start = tags.size
+    except ID3NoHeaderError:
+        tags = ID3()
+        audio_start = 0
+    apply_id3_fields(tags, fields, cover)
+    
+    # Saving into an empty buffer renders just the tag
+    header = io.BytesIO()
+    tags.save(header, padding=lambda info: ID3_PADDING)
+    with open(src_path, 'rb') as src, open(output_path, 'wb') as dest:
+        dest.write(header.getvalue())
+        src.seek(audio_start)
+        shutil.copyfileobj(src, dest, UPLOAD_CHUNK_SIZE)
+    return output_path
+
+def add_id3_tags(mp3_path, title=None, artist=None, album=None, genre=None, track=None, year=None, comment=None,
+                 album_artist=None, cover=None):
     """Add ID3 tags to MP3 file"""
+    fields = {'title': title, 'artist': artist, 'album': album, 'album_artist': album_artist, 'genre': genre,
+              'track': track, 'year': year, 'comment': comment}
     try:
-        # Try to load existing tags
-        try:
-            audio = MP3(mp3_path, ID3=ID3)
-            if audio.tags is None:
-                audio.add_tags()
-        except ID3NoHeaderError:
-            audio = MP3(mp3_path)
-            audio.add_tags()
-        
-        tags = audio.tags
-        
-        if title:
-            tags.add(TIT2(encoding=3, text=title))
-        if artist:
-            tags.add(TPE1(encoding=3, text=artist))
-        if album:
-            tags.add(TALB(encoding=3, text=album))
-        if genre:
-            tags.add(TCON(encoding=3, text=genre))
-        if track:
-            tags.add(TRCK(encoding=3, text=str(track)))
-        if year:
-            tags.add(TDRC(encoding=3, text=str(year)))
-        if comment:
-            tags.add(COMM(encoding=3, lang='eng', desc='', text=comment))
-        
-        audio.save()
+        write_id3_tags(mp3_path, {key: value for key, value in fields.items() if value}, cover)
         return True
     except Exception as e:
-        print(f"Error adding ID3 tags: {e}")
+        app.logger.warning(f"Error adding ID3 tags to {mp3_path}: {e}")
+        increment_stat('id3_tag_failures')
         return False
 
-def trim_video(input_path, output_path, start_time=None, end_time=None):
-    """Trim or copy video using ffmpeg"""
-    cmd = ['ffmpeg', '-y', '-i', input_path]
+def fetch_cover_art(url):
+    """Front-cover art for a video - its thumbnail as a JPEG no bigger than COVER_ART_SIZE square"""
+    thumbnail = get_video_info(url).get('thumbnail')
+    if not thumbnail:
+        raise Exception("This video has no thumbnail to use as cover art")
     
-    # Add trimming options
+    size = COVER_ART_SIZE
+    cmd = ['ffmpeg', '-v', 'error', '-protocol_whitelist', 'http,https,tcp,tls', '-i', thumbnail,
+           '-frames:v', '1', '-vf', f"scale='min({size},iw)':'min({size},ih)':force_original_aspect_ratio=decrease",
+           '-q:v', '3', '-f', 'mjpeg', 'pipe:1']
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=60)
+    except subprocess.TimeoutExpired:
+        raise Exception("Timed out fetching the cover art")
+    if result.returncode != 0 or not result.stdout:
+        raise Exception("Could not fetch the cover art")
+    return {'data': result.stdout, 'mime': 'image/jpeg'}
+
+def seek_args(start_time=None, end_time=None):
+    """Input-side trim options (go before -i) - ffmpeg seeks instead of decoding up to the start"""
+    args = []
     if start_time is not None:
-        cmd.extend(['-ss', str(start_time)])
+        args.extend(['-ss', str(start_time)])
     if end_time is not None:
         if start_time is not None:
-            duration = end_time - start_time
-            cmd.extend(['-t', str(duration)])
+            # Duration instead of end time
+            args.extend(['-t', str(end_time - start_time)])
         else:
-            cmd.extend(['-to', str(end_time)])
-    
-    # Copy streams without re-encoding (fast)
-    cmd.extend(['-c', 'copy', output_path])
+            args.extend(['-to', str(end_time)])
+    return args
+
+def probe_media(input_path, data=None):
+    """Stream and container details from ffprobe (from data on stdin if given)"""
+    if data is not None:
+        input_path = 'pipe:0'
+    cmd = ['ffprobe', '-v', 'error', '-show_streams', '-show_format', '-of', 'json', input_path]
+    result = subprocess.run(cmd, input=data, capture_output=True, timeout=60)
+    if result.returncode != 0:
+        raise Exception(f"Could not read media info: {result.stderr.decode(errors='replace')}")
+    return json.loads(result.stdout)
+
+def plan_conversion(output_format, preset, input_path=None, head=None):
+    """Probe the source and decide whether the audio can be copied instead of re-encoded.
+    head lets an upload that is still arriving be probed from its first bytes."""
+    plan = {}
+    try:
+        info = probe_media(input_path, data=head)
+    except Exception:
+        # ffprobe can't read it (or isn't installed) - encode as usual
+        info = None
     
-    result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+    if info is not None:
+        streams = info.get('streams', [])
+        audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+        video = next((s for s in streams if s.get('codec_type') == 'video'
+                      and not (s.get('disposition') or {}).get('attached_pic')), None)
+        bit_rate = str((audio or {}).get('bit_rate') or info.get('format', {}).get('bit_rate') or '')
+        plan.update({
+            'container': info.get('format', {}).get('format_name'),
+            'audio_codec': audio.get('codec_name') if audio else None,
+            'audio_bitrate': int(bit_rate) if bit_rate.isdigit() else None,
+            'video_codec': video.get('codec_name') if video else None,
+        })
     
+    target = OUTPUT_FORMATS[output_format]
+    if target['media'] == 'audio':
+        plan['action'] = 'encode'
+        if info is not None and plan['audio_codec'] == target['codec'] and ENCODER_PRESETS[preset]['audio_copy']:
+            # Already the target codec - copy it, straight or out of another container
+            same_container = target['container'] in (plan['container'] or '').split(',') and video is None
+            plan['action'] = 'copy' if same_container else 'remux'
+    return plan
+
+def source_audio_codec(input_path):
+    """Codec name of the first audio stream, or None if unknown"""
+    try:
+        info = probe_media(input_path)
+    except Exception:
+        return None
+    audio = next((s for s in info['streams'] if s.get('codec_type') == 'audio'), None)
+    return audio.get('codec_name') if audio else None
+
+def probe_video_packets(input_path, start_time, end_time):
+    """(pts, is_keyframe) for first-video-stream packets shown in [start, end), in decode order
+    (demux only, no decoding)"""
+    cmd = [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        # Read on past the end - B-frames shown before it are stored after later frames
+        '-read_intervals', f"{start_time}%{end_time + 1}",
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', input_path,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
     if result.returncode != 0:
-        # If copy fails (incompatible codecs), try with re-encoding
-        cmd = ['ffmpeg', '-y', '-i', input_path]
-        if start_time is not None:
-            cmd.extend(['-ss', str(start_time)])
-        if end_time is not None:
-            if start_time is not None:
-                duration = end_time - start_time
-                cmd.extend(['-t', str(duration)])
-            else:
-                cmd.extend(['-to', str(end_time)])
-        cmd.extend(['-c:v', 'libx264', '-c:a', 'aac', output_path])
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+        raise Exception(f"Could not read keyframes: {result.stderr}")
+    
+    packets = []
+    for line in result.stdout.splitlines():
+        parts = line.strip().split(',')
+        if len(parts) >= 2 and parts[0] not in ('', 'N/A'):
+            pts = float(parts[0])
+            if start_time <= pts < end_time:
+                packets.append((pts, 'K' in parts[1]))
+    return packets
+
+def frame_seek_point(pts):
+    """-ss value that lands exactly on the frame at pts - a hair before it, since pts_time is rounded
+    and ffmpeg drops (or marks for discard) anything that starts before the seek point"""
+    return f"{max(0.0, pts - 0.000001):.6f}"
+
+def smart_cut_video(input_path, output_path, start_time, end_time, preset=DEFAULT_PRESET):
+    """Frame-accurate cut that stream-copies the keyframe-aligned middle and re-encodes
+    only the partial GOPs at each end. Returns False if the source isn't suitable."""
+    report_progress('trimming')
+    info = probe_media(input_path)
+    video = next((s for s in info['streams'] if s.get('codec_type') == 'video'), None)
+    if video is None or video.get('codec_name') != 'h264':
+        # Boundary pieces are encoded with libx264, so they can only be joined to H.264
+        return False
+    
+    start = start_time or 0
+    end = end_time if end_time is not None else float(info['format']['duration'])
+    packets = probe_video_packets(input_path, start, end)
+    keys = [index for index, (_, is_key) in enumerate(packets) if is_key]
+    if len(keys) < 2:
+        return False
+    
+    # Every piece is sized in frames from the packet list, so the joins neither repeat nor drop one.
+    # The middle copies packets in decode order from the first keyframe up to the last one.
+    first_key = packets[keys[0]][0]
+    middle = [pts for pts, _ in packets[keys[0]:keys[-1]]]
+    if min(middle) < first_key:
+        # Open GOP - frames after the keyframe reference the GOP before it
+        return False
+    head = sorted(pts for pts, _ in packets if pts < first_key)
+    tail = sorted(pts for pts, _ in packets if pts > max(middle))
+    if len(head) + len(middle) + len(tail) != len(packets):
+        return False
+    
+    # Match the copied middle so the pieces concatenate cleanly
+    settings = ENCODER_PRESETS[preset]
+    encode_args = ['-an', '-c:v', 'libx264'] + settings['x264'] + ['-threads', settings['threads']]
+    encode_args.extend(['-pix_fmt', video.get('pix_fmt', 'yuv420p')])
+    timescale = video.get('time_base', '').split('/')[-1]
+    if timescale.isdigit():
+        encode_args.extend(['-video_track_timescale', timescale])
+    
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(output_path))
+    try:
+        pieces = []
+        segments = [
+            (head, encode_args),
+            (middle, ['-an', '-c:v', 'copy']),
+            (tail, encode_args),
+        ]
+        for index, (frames, codec_args) in enumerate(segments):
+            if not frames:
+                continue
+            piece = os.path.join(work_dir, f"piece{index}.mp4")
+            cmd = ['ffmpeg', '-y', '-ss', frame_seek_point(frames[0]), '-i', input_path]
+            cmd.extend(['-frames:v', str(len(frames))] + codec_args + [piece])
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+            if result.returncode != 0:
+                return False
+            pieces.append(piece)
         
-        if result.returncode != 0:
-            raise Exception(f"Video processing failed: {result.stderr}")
+        list_path = os.path.join(work_dir, 'pieces.txt')
+        with open(list_path, 'w') as f:
+            for piece in pieces:
+                f.write(f"file '{piece}'\n")
+        
+        # Join the video pieces and add the audio, cut with an input-side seek
+        cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+        cmd.extend(seek_args(start, end) + ['-i', input_path])
+        cmd.extend(['-map', '0:v', '-map', '1:a?', '-c:v', 'copy'])
+        audio_options = [['-c:a', 'aac'] + settings['aac']]
+        if settings['audio_copy']:
+            audio_options.insert(0, ['-c:a', 'copy'])
+        for audio_args in audio_options:
+            result = subprocess.run(cmd + audio_args + [output_path], capture_output=True, text=True, timeout=600)
+            if result.returncode == 0:
+                return True
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def trim_video(input_path, output_path, start_time=None, end_time=None, preset=DEFAULT_PRESET):
+    """Trim or copy video using ffmpeg - frame-accurate cuts at close to stream-copy speed"""
+    with work_slot('encode'), timed_stage('trim'):
+        return trim_video_unlocked(input_path, output_path, start_time, end_time, preset)
+
+def trim_video_unlocked(input_path, output_path, start_time=None, end_time=None, preset=DEFAULT_PRESET):
+    """trim_video without taking an encode slot"""
+    if start_time is None and end_time is None:
+        # Nothing to cut - copy streams without re-encoding (fast)
+        cmd = ['ffmpeg', '-y', '-i', input_path, '-c', 'copy', output_path]
+        returncode, _ = run_ffmpeg(cmd, timeout=600, duration=clip_duration(input_path), stage='remuxing')
+        if returncode == 0:
+            return True
+        increment_stat('fallback_trim_copy_to_encode')
+    else:
+        try:
+            if smart_cut_video(input_path, output_path, start_time, end_time, preset):
+                return True
+        except Exception:
+            # ffprobe missing or unreadable input - fall back to re-encoding the clip
+            pass
+        increment_stat('fallback_smart_cut_to_encode')
+    
+    # Re-encode just the clip (input-side seek, so nothing before the start is decoded)
+    settings = ENCODER_PRESETS[preset]
+    cmd = ['ffmpeg', '-y'] + seek_args(start_time, end_time) + ['-i', input_path]
+    cmd.extend(['-c:v', 'libx264'] + settings['x264'] + ['-threads', settings['threads']])
+    if settings['audio_copy'] and source_audio_codec(input_path) == 'aac':
+        cmd.extend(['-c:a', 'copy'])
+    else:
+        cmd.extend(['-c:a', 'aac'] + settings['aac'])
+    cmd.append(output_path)
+    returncode, stderr = run_ffmpeg(cmd, timeout=600, duration=clip_duration(input_path, start_time, end_time), stage='trimming')
+    
+    if returncode != 0:
+        raise Exception(f"Video processing failed: {stderr}")
     
     return True
 
-def convert_to_mp3_ffmpeg(input_path, output_path, start_time=None, end_time=None):
-    """Convert audio/video to MP3 with optional trimming using ffmpeg"""
-    cmd = ['ffmpeg', '-y', '-i', input_path]
+def clip_duration(input_path, start_time=None, end_time=None):
+    """Length in seconds of the part of the input being converted (for progress), or None"""
+    if start_time is not None and end_time is not None:
+        return end_time - start_time
+    if current_progress() is None or input_path is None or input_path.startswith('pipe:'):
+        return None
+    try:
+        total = float(probe_media(input_path)['format']['duration'])
+    except Exception:
+        return None
+    return max(0, (end_time if end_time is not None else total) - (start_time or 0))
+
+def read_ffmpeg_progress(stream, reporter, stage, duration):
+    """Turn ffmpeg's -progress key=value blocks into progress reports"""
+    fields = {}
+    for line in stream:
+        key, _, value = line.decode(errors='replace').strip().partition('=')
+        fields[key] = value
+        if key != 'progress':
+            continue
+        
+        out_us = fields.get('out_time_us', '')
+        encoded = int(out_us) / 1000000 if out_us.lstrip('-').isdigit() else 0
+        try:
+            speed = float(fields.get('speed', '').rstrip('x'))
+        except ValueError:
+            speed = None
+        total_size = fields.get('total_size', '')
+        
+        report = {
+            'encoded_seconds': round(max(encoded, 0), 2),
+            'encode_speed': speed,
+            'output_bytes': int(total_size) if total_size.isdigit() else None,
+        }
+        if duration:
+            report['percent'] = round(min(100, max(encoded, 0) / duration * 100), 1)
+            report['eta'] = round(max(duration - encoded, 0) / speed, 1) if speed else None
+        reporter.update(stage, **report)
+        fields = {}
+
+def run_ffmpeg(cmd, timeout, input_chunks=None, duration=None, stage='encoding'):
+    """Run ffmpeg and return (returncode, stderr), reporting -progress output for the current job.
+    If input_chunks is given, stdin is fed from that iterator of byte chunks."""
+    reporter = current_progress()
+    if reporter is not None:
+        cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
     
-    # Add trimming options
-    if start_time is not None:
-        cmd.extend(['-ss', str(start_time)])
-    if end_time is not None:
-        if start_time is not None:
-            # Duration instead of end time
-            duration = end_time - start_time
-            cmd.extend(['-t', str(duration)])
-        else:
-            cmd.extend(['-to', str(end_time)])
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if input_chunks is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE if reporter is not None else subprocess.DEVNULL,
+            stderr=err,
+        )
+        reader = None
+        try:
+            if reporter is not None:
+                reader = threading.Thread(target=read_ffmpeg_progress, args=(proc.stdout, reporter, stage, duration), daemon=True)
+                reader.start()
+            
+            if input_chunks is not None:
+                try:
+                    for chunk in input_chunks:
+                        proc.stdin.write(chunk)
+                except BrokenPipeError:
+                    # ffmpeg exited early - its return code says why
+                    pass
+                finally:
+                    try:
+                        proc.stdin.close()
+                    except BrokenPipeError:
+                        pass
+            
+            proc.wait(timeout=timeout)
+        finally:
+            if proc.poll() is None:
+                # Timed out, or the input failed (a client disconnect) - don't leave ffmpeg running
+                proc.kill()
+                proc.wait()
+            if reader is not None:
+                reader.join()
+                proc.stdout.close()
+        
+        err.seek(0)
+        return proc.returncode, err.read().decode(errors='replace')
+
+def mp3_ffmpeg_cmd(input_path, output_path, start_time=None, end_time=None, metadata=None, input_headers=None,
+                   preset=DEFAULT_PRESET, copy_audio=False):
+    """Build the ffmpeg command that encodes input to MP3 (output_path may be 'pipe:1').
+    With copy_audio the MP3 stream is copied as-is instead of re-encoded."""
+    cmd = ['ffmpeg', '-y']
+    if input_headers:
+        # Headers for reading a remote media URL directly
+        cmd.extend(['-headers', ''.join(f"{key}: {value}\r\n" for key, value in input_headers.items())])
+    
+    # Trimming options go before -i so ffmpeg seeks instead of decoding up to the start.
+    # A pipe can't seek, so piped input is trimmed on the output side.
+    if input_path.startswith('pipe:'):
+        cmd.extend(['-i', input_path] + seek_args(start_time, end_time))
+    else:
+        cmd.extend(seek_args(start_time, end_time) + ['-i', input_path])
+    
+    # ID3 tags written by ffmpeg itself (used when there is no file to tag afterwards)
+    for key, value in (metadata or {}).items():
+        if value:
+            cmd.extend(['-metadata', f"{FFMPEG_METADATA_KEYS[key]}={value}"])
     
     # Output options - extract audio, convert to mp3
-    cmd.extend(['-vn', '-acodec', 'libmp3lame', '-q:a', '2', output_path])
+    settings = ENCODER_PRESETS[preset]
+    if copy_audio:
+        cmd.extend(['-vn', '-acodec', 'copy'])
+    else:
+        cmd.extend(['-vn', '-acodec', 'libmp3lame'] + settings['mp3'] + ['-threads', settings['threads']])
+    cmd.extend(['-f', 'mp3', output_path])
+    return cmd
+
+def convert_to_mp3_ffmpeg(input_path, output_path, start_time=None, end_time=None, input_chunks=None,
+                          preset=DEFAULT_PRESET, copy_audio=False):
+    """Convert audio/video to MP3 with optional trimming using ffmpeg.
+    If input_chunks is given the input is piped to ffmpeg's stdin instead of read from input_path.
+    With copy_audio an MP3 source stream is copied instead of re-encoded."""
+    if input_chunks is not None:
+        input_path = 'pipe:0'
+    cmd = mp3_ffmpeg_cmd(input_path, output_path, start_time, end_time, preset=preset, copy_audio=copy_audio)
     
-    result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+    duration = clip_duration(input_path, start_time, end_time)
+    with timed_stage('transcode'):
+        returncode, stderr = run_ffmpeg(cmd, timeout=300, input_chunks=input_chunks, duration=duration)
     
-    if result.returncode != 0:
-        raise Exception(f"Conversion failed: {result.stderr}")
+    if returncode != 0 and copy_audio and input_chunks is None:
+        # Stream copy refused - encode instead
+        increment_stat('fallback_audio_copy_to_encode')
+        return convert_to_mp3_ffmpeg(input_path, output_path, start_time, end_time, preset=preset)
+    
+    if returncode != 0:
+        raise Exception(f"Conversion failed: {stderr}")
     
     return True
 
-def convert_to_mp3_moviepy(input_path, output_path, start_time=None, end_time=None):
-    """Fallback conversion using moviepy for video files"""
-    from moviepy import VideoFileClip
+def convert_to_m4a(input_path, output_path, start_time=None, end_time=None, preset=DEFAULT_PRESET, copy_audio=False):
+    """Extract audio to M4A - remuxes AAC sources, encodes anything else to AAC"""
+    settings = ENCODER_PRESETS[preset]
+    cmd = ['ffmpeg', '-y'] + seek_args(start_time, end_time) + ['-i', input_path, '-vn']
+    if copy_audio:
+        cmd.extend(['-c:a', 'copy'])
+    else:
+        cmd.extend(['-c:a', 'aac'] + settings['aac'] + ['-threads', settings['threads']])
+    cmd.extend(['-movflags', '+faststart', output_path])
     
-    clip = VideoFileClip(input_path)
-    audio = clip.audio
+    with timed_stage('transcode'):
+        returncode, stderr = run_ffmpeg(cmd, timeout=300, duration=clip_duration(input_path, start_time, end_time))
     
-    if audio is None:
-        raise Exception("No audio track found in video")
+    if returncode != 0:
+        if copy_audio:
+            # Stream copy refused - encode instead
+            increment_stat('fallback_audio_copy_to_encode')
+            return convert_to_m4a(input_path, output_path, start_time, end_time, preset)
+        raise Exception(f"Conversion failed: {stderr}")
     
-    # Apply trimming if specified
-    if start_time is not None or end_time is not None:
-        start = start_time if start_time is not None else 0
-        end = end_time if end_time is not None else audio.duration
-        
-        # Ensure valid range
-        start = max(0, min(start, audio.duration))
-        end = max(start, min(end, audio.duration))
-        
-        audio = audio.subclipped(start, end)
+    return True
+
+def stream_ffmpeg_output(cmd, chunk_size=64 * 1024):
+    """Start ffmpeg writing to stdout and return a generator of the encoded bytes.
+    Fails up front if ffmpeg exits before producing any output."""
+    err = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=err)
+    first = proc.stdout.read1(chunk_size)
+    
+    if not first:
+        proc.wait()
+        err.seek(0)
+        message = err.read().decode(errors='replace')
+        err.close()
+        raise Exception(f"Conversion failed: {message}")
+    
+    def generate():
+        try:
+            chunk = first
+            while chunk:
+                yield chunk
+                chunk = proc.stdout.read1(chunk_size)
+            proc.wait()
+        finally:
+            # Client went away or we finished - never leave ffmpeg running
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            err.close()
+    
+    return generate()
+
+def classify_ffmpeg_failure(message):
+    """'input' if an ffmpeg error means the input itself is unusable (no fallback can help),
+    otherwise 'retryable'"""
+    if any(pattern in message for pattern in FFMPEG_INPUT_ERRORS):
+        return 'input'
+    return 'retryable'
+
+def fallback_ffmpeg_binary():
+    """ffmpeg for the fallback path - the build bundled with imageio-ffmpeg if installed
+    (it has libmp3lame even when the system build doesn't), else the system one"""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return 'ffmpeg'
+
+def convert_to_mp3_streaming(input_path, output_path, start_time=None, end_time=None, preset=DEFAULT_PRESET):
+    """Fallback MP3 conversion in constant memory: one process decodes only the first audio stream
+    to raw PCM (skipping corrupt packets), a second encodes it, and fixed-size chunks are relayed
+    between them."""
+    binary = fallback_ffmpeg_binary()
+    pcm_args = ['-f', 's16le', '-ac', '2', '-ar', str(FALLBACK_SAMPLE_RATE)]
+    decode_cmd = [binary, '-v', 'error', '-nostdin', '-fflags', '+discardcorrupt+genpts', '-err_detect', 'ignore_err']
+    decode_cmd.extend(seek_args(start_time, end_time) + ['-i', input_path, '-map', '0:a:0', '-vn', '-sn', '-dn'])
+    decode_cmd.extend(pcm_args + ['pipe:1'])
+    encode_cmd = [binary, '-y', '-v', 'error'] + pcm_args + ['-i', 'pipe:0', '-c:a', 'libmp3lame']
+    encode_cmd.extend(ENCODER_PRESETS[preset]['mp3'] + ['-f', 'mp3', output_path])
     
-    audio.write_audiofile(output_path)
-    audio.close()
-    clip.close()
+    bytes_per_second = FALLBACK_SAMPLE_RATE * 4
+    deadline = time.time() + 300
+    relayed = 0
+    with tempfile.TemporaryFile() as decode_err, tempfile.TemporaryFile() as encode_err:
+        decoder = subprocess.Popen(decode_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=decode_err)
+        encoder = subprocess.Popen(encode_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=encode_err)
+        try:
+            while True:
+                chunk = decoder.stdout.read(FALLBACK_CHUNK_SIZE)
+                if not chunk:
+                    break
+                encoder.stdin.write(chunk)
+                relayed += len(chunk)
+                report_progress('encoding', encoded_seconds=round(relayed / bytes_per_second, 2))
+                if time.time() > deadline:
+                    raise Exception("Conversion failed: timed out")
+            encoder.stdin.close()
+            decoder.wait(timeout=max(1, deadline - time.time()))
+            encoder.wait(timeout=max(1, deadline - time.time()))
+        except BrokenPipeError:
+            # Encoder exited early - its return code says why
+            encoder.wait()
+        finally:
+            for proc in (decoder, encoder):
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+            decoder.stdout.close()
+        
+        if encoder.returncode != 0 or relayed == 0:
+            # A decoder that skipped damaged packets may exit non-zero - that's fine if audio came out
+            err = encode_err if encoder.returncode != 0 else decode_err
+            err.seek(0)
+            raise Exception(f"Conversion failed: {err.read().decode(errors='replace') or 'no audio decoded'}")
     
     return True
 
-def convert_to_mp3(input_path, output_path, start_time=None, end_time=None):
-    """Convert to MP3, trying ffmpeg first, then moviepy"""
+def convert_to_mp3(input_path, output_path, start_time=None, end_time=None, preset=DEFAULT_PRESET, copy_audio=False):
+    """Convert to MP3 with ffmpeg, falling back to the streaming audio-only path when that can help"""
     try:
-        return convert_to_mp3_ffmpeg(input_path, output_path, start_time, end_time)
+        return convert_to_mp3_ffmpeg(input_path, output_path, start_time, end_time, preset=preset, copy_audio=copy_audio)
     except FileNotFoundError:
-        # ffmpeg not installed, try moviepy
-        return convert_to_mp3_moviepy(input_path, output_path, start_time, end_time)
+        # ffmpeg not installed - the fallback can use the bundled binary
+        increment_stat('fallback_ffmpeg_to_streaming')
+        with timed_stage('fallback'):
+            return convert_to_mp3_streaming(input_path, output_path, start_time, end_time, preset)
+    except subprocess.TimeoutExpired:
+        # The fallback would take just as long
+        raise Exception("Conversion failed: timed out")
     except Exception as e:
-        # ffmpeg failed, try moviepy as fallback
+        if classify_ffmpeg_failure(str(e)) == 'input':
+            increment_stat('ffmpeg_input_errors')
+            raise
+        increment_stat('fallback_ffmpeg_to_streaming')
         try:
-            return convert_to_mp3_moviepy(input_path, output_path, start_time, end_time)
-        except:
-            # If moviepy also fails, raise original error
+            with timed_stage('fallback'):
+                return convert_to_mp3_streaming(input_path, output_path, start_time, end_time, preset)
+        except Exception:
+            # If the fallback also fails, raise the original error
             raise e
 
 @app.route('/')
 def home():
-    return render_template('index.html')
+    presets = [(name, PRESET_LABELS.get(name, name.title())) for name in ALLOWED_PRESETS]
+    return render_template('index.html', presets=presets, default_preset=DEFAULT_PRESET)
 
 @app.route('/fetch-info', methods=['POST'])
 def fetch_info():
@@ -412,138 +1322,372 @@ def fetch_info():
         if not url:
             return jsonify({'error': 'Please enter a video URL'}), 400
         
+        rejected = admission_response(INFO_REQUEST_COST, queued=False, writes_disk=False)
+        if rejected:
+            return rejected
+        
         info = get_video_info(url)
         return jsonify(info)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
-@app.route('/convert', methods=['POST'])
-def convert():
-    """Convert video to MP3 or MP4"""
-    temp_file = None
-    output_path = None
+def file_sha256(path):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@functools.lru_cache(maxsize=1024)
+def canonical_video_id(url):
+    """Stable ID for a URL (extractor + video ID) worked out without touching the network"""
+    import yt_dlp
+    
+    url = url.strip()
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        if ie.ie_key() != 'Generic' and ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            if video_id:
+                return f"{ie.ie_key()}:{video_id}"
+            break
+    return f"url:{url}"
+
+@contextlib.contextmanager
+def locked_stats():
+    """Read-modify-write the stats shared by every process (kept in a locked JSON file)"""
+    with open(STATS_FILE + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        stats = read_stats()
+        yield stats
+        tmp_path = STATS_FILE + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, STATS_FILE)
+
+def increment_stat(name, amount=1):
+    """Bump a counter shared by every process"""
+    with locked_stats() as stats:
+        stats[name] = stats.get(name, 0) + amount
+
+def observe_stage(stage, seconds, failed=False):
+    """Add one timing to a stage's duration histogram"""
+    with locked_stats() as stats:
+        histogram = stats.setdefault('stage_seconds', {}).setdefault(
+            stage, {'buckets': [0] * len(STAGE_BUCKETS), 'sum': 0, 'count': 0})
+        for index, bound in enumerate(STAGE_BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][index] += 1
+                break
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+        if failed:
+            stats[f"stage_failures_{stage}"] = stats.get(f"stage_failures_{stage}", 0) + 1
+
+@contextlib.contextmanager
+def timed_stage(stage):
+    """Time a block (or decorated function) into the stage's histogram on /metrics"""
+    started = time.time()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        observe_stage(stage, time.time() - started, failed)
+
+def after_response(response, callback):
+    """Call callback once the response has finished streaming to the client (or the client left)"""
+    # Werkzeug skips on-close callbacks for passthrough (send_file) responses, so the file is
+    # streamed through the response's own iterator instead
+    response.direct_passthrough = False
+    response.call_on_close(callback)
+    return response
+
+def track_send(response, size):
+    """Record the send time and bytes of a response once it has been streamed"""
+    started = time.time()
     
+    def finished():
+        observe_stage('send', time.time() - started)
+        increment_stat('bytes_out', size)
+    return after_response(response, finished)
+
+def count_bytes_out(chunks):
+    """Pass a response's chunks through, recording send time and bytes when it ends"""
+    started = time.time()
+    total = 0
+    try:
+        for chunk in chunks:
+            total += len(chunk)
+            yield chunk
+    finally:
+        observe_stage('send', time.time() - started)
+        increment_stat('bytes_out', total)
+
+def read_stats():
+    """Current values of all shared counters"""
     try:
-        input_type = request.form.get('input_type', 'file')
-        output_format = request.form.get('output_format', 'mp3')  # mp3 or mp4
-        start_time = parse_time_to_seconds(request.form.get('start_time', ''))
-        end_time = parse_time_to_seconds(request.form.get('end_time', ''))
+        with open(STATS_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def result_cache_key(source_id, output_format, start_time, end_time, preset=DEFAULT_PRESET):
+    """Cache key for a finished output - source identity plus everything that changes its bytes"""
+    key_data = {
+        'source': source_id,
+        'format': output_format,
+        'start': start_time,
+        'end': end_time,
+        'preset': ENCODER_PRESETS[preset],
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+def cache_get(tier, key):
+    """Return the cached entry for a key (and mark it recently used), or None"""
+    folder = CACHE_TIERS[tier]['folder']
+    meta_path = os.path.join(folder, f"{key}.json")
+    try:
+        with open(meta_path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        increment_stat(f"{tier}_cache_misses")
+        return None
+    
+    entry['path'] = os.path.join(folder, entry['file'])
+    if not os.path.exists(entry['path']):
+        increment_stat(f"{tier}_cache_misses")
+        return None
+    
+    # Access time drives LRU eviction
+    now = time.time()
+    os.utime(entry['path'], (now, now))
+    os.utime(meta_path, (now, now))
+    increment_stat(f"{tier}_cache_hits")
+    return entry
+
+def cache_put(tier, key, file_path, **info):
+    """Move a file into a cache tier and return its cache entry"""
+    folder = CACHE_TIERS[tier]['folder']
+    ext = os.path.splitext(file_path)[1]
+    entry = dict(info, file=f"{key}{ext}")
+    entry['path'] = os.path.join(folder, entry['file'])
+    
+    os.replace(file_path, entry['path'])
+    meta_path = os.path.join(folder, f"{key}.json")
+    # Unique per writer - identical jobs finishing together put the same key
+    tmp_path = f"{meta_path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({k: v for k, v in entry.items() if k != 'path'}, f)
+    os.replace(tmp_path, meta_path)
+    
+    evict_cache(tier)
+    return entry
+
+def link_or_copy(path, output_path, writable=False):
+    """Place a cached file at output_path - hard link if possible, copy if it will be modified"""
+    if not writable:
+        try:
+            os.link(path, output_path)
+            return output_path
+        except OSError:
+            pass
+    shutil.copyfile(path, output_path)
+    return output_path
+
+def cache_usage(tier):
+    """List (mtime, size, path) for every cached file in a tier"""
+    folder = CACHE_TIERS[tier]['folder']
+    entries = []
+    for name in os.listdir(folder):
+        if name.endswith('.json') or name.endswith('.tmp'):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+def evict_cache(tier, max_bytes=None):
+    """Drop least recently used entries until the tier fits its size budget (or max_bytes)"""
+    folder = CACHE_TIERS[tier]['folder']
+    entries = cache_usage(tier)
+    total = sum(size for _, size, _ in entries)
+    if max_bytes is None:
+        max_bytes = CACHE_TIERS[tier]['max_bytes']
+    
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        key = os.path.splitext(os.path.basename(path))[0]
+        for stale in (path, os.path.join(folder, f"{key}.json")):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+        total -= size
+        increment_stat(f"{tier}_cache_evictions")
+
+def source_cache_key(url, media):
+    """Source cache key - one entry per video and media type"""
+    return hashlib.sha256(f"{canonical_video_id(url)}|{media}".encode()).hexdigest()
+
+def find_source(url, media):
+    """Cached untouched download for a URL, or None"""
+    return cache_get('source', source_cache_key(url, media))
+
+def fetch_source(url, media, scratch_dir):
+    """Download the full untouched source (via scratch_dir) and add it to the source cache"""
+    if media == 'video':
+        path, title = download_video(url, scratch_dir)
+    else:
+        path, title = download_video_audio(url, scratch_dir)
+    return cache_put('source', source_cache_key(url, media), path, title=title)
+
+def convert_audio(input_path, output_path, output_format, start_time=None, end_time=None, preset=DEFAULT_PRESET):
+    """Probe the source, then copy or encode its audio to MP3/M4A; returns the conversion plan"""
+    plan = plan_conversion(output_format, preset, input_path)
+    copy_audio = plan['action'] in ('copy', 'remux')
+    
+    with work_slot('encode'):
+        if output_format == 'm4a':
+            convert_to_m4a(input_path, output_path, start_time, end_time, preset, copy_audio)
+        else:
+            convert_to_mp3(input_path, output_path, start_time, end_time, preset, copy_audio)
+    return plan
+
+def encode_outputs(input_path, outputs, preset=DEFAULT_PRESET):
+    """Make several outputs (see parse_outputs) from one decode of the input in a single ffmpeg run.
+    outputs is a list of (output, path); a 'peaks' output is written as raw mono PCM for waveform_peaks."""
+    settings = ENCODER_PRESETS[preset]
+    # Seek the input to the window every output falls in, then trim each output within it
+    window_start = min(output['start_time'] or 0 for output, _ in outputs)
+    ends = [output['end_time'] for output, _ in outputs]
+    window_end = None if None in ends else max(ends)
+    cmd = ['ffmpeg', '-y'] + seek_args(window_start or None, window_end) + ['-i', input_path]
+    
+    for output, path in outputs:
+        offset = (output['start_time'] or 0) - window_start
+        if offset > 0:
+            cmd.extend(['-ss', str(offset)])
+        if output['end_time'] is not None:
+            cmd.extend(['-t', str(output['end_time'] - (output['start_time'] or 0))])
         
-        # Metadata fields (for MP3 only)
-        meta_title = request.form.get('meta_title', '').strip()
-        meta_artist = request.form.get('meta_artist', '').strip()
-        meta_album = request.form.get('meta_album', '').strip()
-        meta_genre = request.form.get('meta_genre', '').strip()
-        meta_track = request.form.get('meta_track', '').strip()
-        meta_year = request.form.get('meta_year', '').strip()
-        meta_comment = request.form.get('meta_comment', '').strip()
-        
-        if input_type == 'url':
-            # Handle URL input
-            video_url = request.form.get('video_url', '').strip()
-            
-            if not video_url:
-                return jsonify({'error': 'Please enter a video URL'}), 400
+        output_format = output['format']
+        if output_format == 'mp4':
+            cmd.extend(['-map', '0:v:0', '-map', '0:a:0?'])
+            if output['start_time'] is not None or output['end_time'] is not None:
+                # Smart cuts take passes of their own - in a shared run the clip is re-encoded
+                cmd.extend(['-c:v', 'libx264'] + settings['x264'] + ['-c:a', 'aac'] + settings['aac'])
+            else:
+                cmd.extend(['-c', 'copy'])
+            cmd.extend(['-threads', settings['threads'], '-movflags', '+faststart', '-f', 'mp4'])
+        elif output_format == 'm4a':
+            bitrate_args = ['-b:a', output['bitrate']] if output['bitrate'] else settings['aac']
+            cmd.extend(['-map', '0:a:0', '-c:a', 'aac'] + bitrate_args)
+            cmd.extend(['-threads', settings['threads'], '-movflags', '+faststart', '-f', 'ipod'])
+        elif output_format == 'peaks':
+            cmd.extend(['-map', '0:a:0', '-ac', '1', '-ar', str(PEAKS_SAMPLE_RATE), '-c:a', 'pcm_s16le', '-f', 's16le'])
+        else:
+            # MP3 and the MP3 preview clip
+            bitrate_args = ['-b:a', output['bitrate']] if output['bitrate'] else settings['mp3']
+            cmd.extend(['-map', '0:a:0', '-c:a', 'libmp3lame'] + bitrate_args)
+            cmd.extend(['-threads', settings['threads'], '-f', 'mp3'])
+        cmd.append(path)
+    
+    duration = clip_duration(input_path, window_start or None, window_end)
+    with work_slot('encode'), timed_stage('transcode'):
+        returncode, stderr = run_ffmpeg(cmd, timeout=600, duration=duration)
+    
+    if returncode != 0:
+        raise Exception(f"Conversion failed: {stderr}")
+    return True
+
+def waveform_peaks(pcm_path, output_path, points=PEAKS_POINTS):
+    """Write a waveform overview of mono 16-bit PCM as audiowaveform-style JSON -
+    min/max pairs for up to `points` equal slices of the audio"""
+    samples = os.path.getsize(pcm_path) // 2
+    per_point = max(1, math.ceil(samples / points))
+    data = []
+    with open(pcm_path, 'rb') as f:
+        while True:
+            block = f.read(per_point * 2)
+            if len(block) < 2:
+                break
+            values = array.array('h')
+            values.frombytes(block[:len(block) // 2 * 2])
+            if sys.byteorder == 'big':
+                values.byteswap()
+            data.extend([min(values), max(values)])
+    
+    with open(output_path, 'w') as f:
+        json.dump({
+            'version': 2,
+            'channels': 1,
+            'sample_rate': PEAKS_SAMPLE_RATE,
+            'samples_per_pixel': per_point,
+            'bits': 16,
+            'length': len(data) // 2,
+            'duration': round(samples / PEAKS_SAMPLE_RATE, 3),
+            'data': data,
+        }, f)
+    return output_path
+
+def build_output(params, output_path):
+    """Download or read the source and write the untagged output.
+    Returns the source title and the conversion plan (what was probed and copied/encoded)."""
+    temp_file = params.get('upload_path')
+    
+    output_format = params.get('output_format', 'mp3')
+    start_time = params.get('start_time')
+    end_time = params.get('end_time')
+    preset = params.get('preset', DEFAULT_PRESET)
+    media = OUTPUT_FORMATS[output_format]['media']
+    title = None
+    
+    try:
+        if params.get('input_type') == 'url':
+            trimming = start_time is not None or end_time is not None
+            source = find_source(params['video_url'], media)
             
-            if output_format == 'mp4':
-                # Download as video
-                temp_file, title = download_video(video_url, UPLOAD_FOLDER)
-                
-                # Use metadata title for filename if provided
-                if meta_title:
-                    title = sanitize_filename(meta_title)
-                
-                # If trimming is needed, process with ffmpeg
-                if start_time is not None or end_time is not None:
-                    output_path = os.path.join(UPLOAD_FOLDER, f"{title}_trimmed.mp4")
-                    trim_video(temp_file, output_path, start_time, end_time)
-                else:
-                    output_path = temp_file
+            if source is None and trimming and RANGE_DOWNLOADS:
+                # Nothing cached - download just the trim window, already cut to length
+                if media == 'video':
+                    temp_file, title = download_video(params['video_url'], params['scratch_dir'], start_time, end_time)
+                    plan = plan_conversion(output_format, preset, temp_file)
+                    os.replace(temp_file, output_path)
                     temp_file = None
-                
-                download_filename = f"{title}.mp4"
-                mimetype = 'video/mp4'
+                else:
+                    temp_file, title = download_video_audio(params['video_url'], params['scratch_dir'], start_time, end_time)
+                    plan = convert_audio(temp_file, output_path, output_format, preset=preset)
             else:
-                # Download as audio (MP3)
-                temp_file, title = download_video_audio(video_url, UPLOAD_FOLDER)
-                
-                if meta_title:
-                    title = sanitize_filename(meta_title)
+                # Work from the cached pristine source so each trim/format is one local encode
+                if source is None:
+                    source = fetch_source(params['video_url'], media, params['scratch_dir'])
+                title = source['title']
                 
-                if start_time is not None or end_time is not None:
-                    output_path = os.path.join(UPLOAD_FOLDER, f"{title}_trimmed.mp3")
-                    convert_to_mp3(temp_file, output_path, start_time, end_time)
+                if media == 'video':
+                    plan = plan_conversion(output_format, preset, source['path'])
+                    # If trimming is needed, process with ffmpeg
+                    if trimming:
+                        trim_video(source['path'], output_path, start_time, end_time, preset)
+                    else:
+                        link_or_copy(source['path'], output_path)
                 else:
-                    output_path = temp_file
-                    temp_file = None
-                
-                download_filename = f"{title}.mp3"
-                mimetype = 'audio/mpeg'
-                
-                # Add ID3 tags for MP3
-                if any([meta_title, meta_artist, meta_album, meta_genre, meta_track, meta_year, meta_comment]):
-                    add_id3_tags(
-                        output_path,
-                        title=meta_title,
-                        artist=meta_artist,
-                        album=meta_album,
-                        genre=meta_genre,
-                        track=meta_track,
-                        year=meta_year,
-                        comment=meta_comment
-                    )
-            
+                    plan = convert_audio(source['path'], output_path, output_format, start_time, end_time, preset)
         else:
-            # Handle file upload
-            video_file = request.files.get('video')
-            
-            if not video_file or video_file.filename == '':
-                return jsonify({'error': 'Please select a video file'}), 400
-            
-            filename = secure_filename(video_file.filename)
-            temp_file = os.path.join(UPLOAD_FOLDER, filename)
-            video_file.save(temp_file)
-            base_name = os.path.splitext(filename)[0]
-            
-            if meta_title:
-                base_name = sanitize_filename(meta_title)
-            
-            if output_format == 'mp4':
+            # Handle uploaded file (already saved by the request handler)
+            if media == 'video':
                 # Convert/trim video
-                output_path = os.path.join(UPLOAD_FOLDER, f"{base_name}_output.mp4")
-                trim_video(temp_file, output_path, start_time, end_time)
-                download_filename = f"{base_name}.mp4"
-                mimetype = 'video/mp4'
+                plan = plan_conversion(output_format, preset, temp_file)
+                trim_video(temp_file, output_path, start_time, end_time, preset)
             else:
-                # Convert to MP3
-                output_path = os.path.join(UPLOAD_FOLDER, f"{base_name}.mp3")
-                convert_to_mp3(temp_file, output_path, start_time, end_time)
-                download_filename = f"{base_name}.mp3"
-                mimetype = 'audio/mpeg'
-                
-                # Add ID3 tags for MP3
-                if any([meta_title, meta_artist, meta_album, meta_genre, meta_track, meta_year, meta_comment]):
-                    add_id3_tags(
-                        output_path,
-                        title=meta_title,
-                        artist=meta_artist,
-                        album=meta_album,
-                        genre=meta_genre,
-                        track=meta_track,
-                        year=meta_year,
-                        comment=meta_comment
-                    )
-        
-        # Send the file to user with proper filename
-        return send_file(
-            output_path, 
-            as_attachment=True, 
-            download_name=download_filename,
-            mimetype=mimetype
-        )
+                # Convert to MP3/M4A
+                plan = convert_audio(temp_file, output_path, output_format, start_time, end_time, preset)
         
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+        return title, plan
     
     finally:
         # Cleanup temp files
@@ -553,5 +1697,1544 @@ def convert():
             except:
                 pass
 
+def fill_auto_tags(params):
+    """Fill empty title/artist/album/year tags from the video's info (batch mode)"""
+    info = get_video_info(params['video_url'])
+    meta = params.setdefault('meta', {})
+    for key in ('title', 'artist', 'album', 'year'):
+        if not meta.get(key) and info.get(key):
+            meta[key] = str(info[key])
+
+def process_conversion(params):
+    """Run the full download/convert pipeline for one job and return the result file info"""
+    output_format = params.get('output_format', 'mp3')
+    
+    if params.get('auto_tags') and params.get('input_type') == 'url':
+        try:
+            fill_auto_tags(params)
+        except Exception:
+            # Tags are a nice-to-have - the download reports real failures
+            pass
+    ext = OUTPUT_FORMATS[output_format]['ext']
+    
+    if params.get('input_type') == 'url':
+        source_id = canonical_video_id(params['video_url'])
+    else:
+        source_id = f"sha256:{file_sha256(params['upload_path'])}"
+        increment_stat('bytes_in_upload', os.path.getsize(params['upload_path']))
+    
+    if params.get('outputs'):
+        return process_outputs(params, source_id)
+    
+    key = result_cache_key(source_id, output_format, params.get('start_time'), params.get('end_time'),
+                           params.get('preset', DEFAULT_PRESET))
+    entry = cache_get('result', key)
+    
+    if entry is None:
+        work_path = os.path.join(params['scratch_dir'], f"work_{uuid.uuid4().hex}.{ext}")
+        try:
+            title, plan = build_output(params, work_path)
+            entry = cache_put('result', key, work_path, title=title, conversion=plan)
+        finally:
+            if os.path.exists(work_path):
+                os.remove(work_path)
+    elif params.get('upload_path') and os.path.exists(params['upload_path']):
+        os.remove(params['upload_path'])
+    
+    return deliver_output(params, entry)
+
+def process_outputs(params, source_id):
+    """Make every output of a multi-output job from one download and one ffmpeg run.
+    Cached outputs are reused and only the missing ones are encoded. Returns the job result fields
+    (the first output's, plus the list of all of them)."""
+    outputs = params['outputs']
+    preset = params.get('preset', DEFAULT_PRESET)
+    
+    entries = {}
+    missing = []
+    for index, output in enumerate(outputs):
+        # The bitrate is part of the format as far as the cache is concerned
+        cache_format = f"{output['format']}@{output['bitrate']}" if output['bitrate'] else output['format']
+        key = result_cache_key(source_id, cache_format, output['start_time'], output['end_time'], preset)
+        entry = cache_get('result', key)
+        if entry is None:
+            missing.append((index, key))
+        else:
+            entries[index] = entry
+    
+    if missing:
+        title = None
+        if params.get('input_type') == 'url':
+            # One download feeds every output - the video if any output needs it
+            media = 'video' if any(outputs[index]['format'] == 'mp4' for index, _ in missing) else 'audio'
+            source = find_source(params['video_url'], media) or fetch_source(params['video_url'], media, params['scratch_dir'])
+            input_path, title = source['path'], source['title']
+        else:
+            input_path = params['upload_path']
+        
+        work_paths = {}
+        for index, _ in missing:
+            output_format = outputs[index]['format']
+            ext = 'pcm' if output_format == 'peaks' else (OUTPUT_FORMATS.get(output_format) or EXTRA_OUTPUTS[output_format])['ext']
+            work_paths[index] = os.path.join(params['scratch_dir'], f"work_{uuid.uuid4().hex}.{ext}")
+        encode_outputs(input_path, [(outputs[index], work_paths[index]) for index, _ in missing], preset)
+        
+        for index, key in missing:
+            work_path = work_paths[index]
+            if outputs[index]['format'] == 'peaks':
+                # Not .json - the cache keeps its entry metadata under that extension
+                work_path = waveform_peaks(work_path, f"{work_path[:-len('.pcm')]}.peaks")
+            entries[index] = cache_put('result', key, work_path, title=title, conversion={'action': 'encode'})
+    
+    results = []
+    for index, output in enumerate(outputs):
+        result = deliver_output(params, entries[index], output=output)
+        result.update(format=output['format'], bitrate=output['bitrate'], label=output['label'])
+        results.append(result)
+    return dict(results[0], outputs=results)
+
+def deliver_output(params, entry, output_dir=RESULTS_FOLDER, output=None):
+    """Copy a cached output to a per-job result file (in the result store unless output_dir
+    says otherwise), name it and apply ID3 tags. output is one of a multi-output job's outputs."""
+    report_progress('finishing')
+    output_format = output['format'] if output else params.get('output_format', 'mp3')
+    meta = params.get('meta', {})
+    target = OUTPUT_FORMATS.get(output_format) or EXTRA_OUTPUTS[output_format]
+    ext = target['ext']
+    output_path = os.path.join(output_dir, f"result_{uuid.uuid4().hex}.{ext}")
+    
+    tagging = ext == 'mp3' and any(meta.values())
+    
+    if meta.get('title'):
+        title = sanitize_filename(meta['title'])
+    elif params.get('input_type') == 'url':
+        title = entry.get('title') or 'downloaded_video'
+    else:
+        title = os.path.splitext(params['upload_name'])[0]
+    
+    # Add ID3 tags for MP3 - a tagged copy is written in one pass, untagged
+    # results share the cached file
+    tagged = False
+    if tagging:
+        with timed_stage('id3'):
+            try:
+                copy_with_id3_tags(entry['path'], output_path, {key: value for key, value in meta.items() if value})
+                tagged = True
+            except Exception as e:
+                app.logger.warning(f"Error adding ID3 tags to {output_path}: {e}")
+                increment_stat('id3_tag_failures')
+    if not tagged:
+        link_or_copy(entry['path'], output_path)
+    
+    return {
+        'output_path': output_path,
+        'download_filename': f"{title}{output['label'] if output else ''}.{ext}",
+        'mimetype': target['mimetype'],
+        'conversion': entry.get('conversion'),
+        'expires': time.time() + RESULT_TTL,
+    }
+
+def mp4_moov_first(head):
+    """True if an MP4's moov atom comes before mdat (faststart), False if after, None if unknown"""
+    pos = 0
+    while pos + 8 <= len(head):
+        size = int.from_bytes(head[pos:pos + 4], 'big')
+        box = head[pos + 4:pos + 8]
+        if box == b'moov':
+            return True
+        if box == b'mdat':
+            return False
+        if size == 1:
+            # 64-bit box size follows the type
+            if pos + 16 > len(head):
+                return None
+            size = int.from_bytes(head[pos + 8:pos + 16], 'big')
+        if size < 8:
+            return None
+        pos += size
+    return None
+
+def can_stream_upload(filename, head):
+    """Whether ffmpeg can decode this upload from a pipe without seeking"""
+    ext = os.path.splitext(filename)[1].lower().lstrip('.')
+    if ext in STREAMABLE_EXTENSIONS:
+        return True
+    if ext in MP4_EXTENSIONS:
+        return mp4_moov_first(head) is True
+    return False
+
+def stream_conversion(job_id, params, head, stream):
+    """Encode an upload to MP3 while it is still arriving, then cache and deliver it"""
+    update_job(job_id, status='running', started=time.time(), streamed=True)
+    set_progress_reporter(ProgressReporter(job_id))
+    report_progress('encoding')
+    digest = hashlib.sha256()
+    received = 0
+    
+    def chunks():
+        nonlocal received
+        data = head
+        while data:
+            digest.update(data)
+            received += len(data)
+            yield data
+            data = stream.read(UPLOAD_CHUNK_SIZE)
+    
+    work_path = os.path.join(params['scratch_dir'], f"work_{uuid.uuid4().hex}.mp3")
+    try:
+        preset = params.get('preset', DEFAULT_PRESET)
+        plan = plan_conversion('mp3', preset, head=head)
+        input_chunks = chunks()
+        convert_to_mp3_ffmpeg(None, work_path, params.get('start_time'), params.get('end_time'),
+                              input_chunks=input_chunks, preset=preset, copy_audio=plan['action'] != 'encode')
+        # ffmpeg stops reading at a trim's end - the rest still goes into the hash (and the byte count),
+        # or different files that start the same would share a cache entry
+        for _ in input_chunks:
+            pass
+        key = result_cache_key(f"sha256:{digest.hexdigest()}", 'mp3', params.get('start_time'), params.get('end_time'), preset)
+        entry = cache_put('result', key, work_path, title=None, conversion=plan)
+        result = deliver_output(params, entry)
+        update_job(job_id, status='done', finished=time.time(), **result)
+        increment_stat('jobs_done')
+    except Exception as e:
+        app.logger.warning(f"Job {job_id} failed: {e}")
+        update_job(job_id, status='failed', finished=time.time(), error=str(e))
+        increment_stat('jobs_failed')
+    finally:
+        set_progress_reporter(None)
+        increment_stat('bytes_in_upload', received)
+        # The result is in the result store - nothing in scratch is needed any more
+        remove_scratch_dir(params['scratch_dir'])
+
+def job_path(job_id):
+    """Path of the JSON status file for a job"""
+    return os.path.join(JOBS_FOLDER, f"{job_id}.json")
+
+def owner_lock_path(owner_id):
+    return os.path.join(ADMISSION_FOLDER, f"owner.{owner_id}.lock")
+
+def job_lock_path(job_id):
+    return os.path.join(ADMISSION_FOLDER, f"job.{job_id}.lock")
+
+def job_owner():
+    """This process's owner ID for the jobs it queues; its lock is held until the process exits"""
+    global _job_owner
+    with _scheduler_lock:
+        if _job_owner is None or _job_owner[0] != os.getpid():
+            owner_id = uuid.uuid4().hex
+            # Locked before it appears under its real name, so fail_orphaned_jobs never sees it free
+            tmp_path = owner_lock_path(owner_id) + '.tmp'
+            handle = open(tmp_path, 'a')
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            os.rename(tmp_path, owner_lock_path(owner_id))
+            _job_owner = (os.getpid(), owner_id, handle)
+        return _job_owner[1]
+
+@contextlib.contextmanager
+def running_job(job_id):
+    """Hold a job's lock while this process runs it"""
+    path = job_lock_path(job_id)
+    with open(path, 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+def fail_orphaned_jobs():
+    """Mark queued and running jobs that no live process will finish as failed - a web worker's
+    queue is lost when it restarts or crashes, and pool workers die with it"""
+    for name in os.listdir(JOBS_FOLDER):
+        job = load_job(name[:-len('.json')]) if name.endswith('.json') else None
+        if not job or job.get('status') not in ('queued', 'running'):
+            continue
+        status = job['status']
+        if status == 'queued':
+            lock_path = owner_lock_path(job.get('owner') or 'unknown')
+        else:
+            lock_path = job_lock_path(job['id'])
+        
+        with open(lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            if status == 'running':
+                # Nobody will run this job again - the lock file only marks who is running it
+                os.remove(lock_path)
+            # Re-read under the lock - the job may have started or finished since
+            job = load_job(job['id'])
+            if job and job['status'] == status:
+                app.logger.warning(f"Job {job['id']} was left {status} by a process that has exited")
+                update_job(job['id'], status='failed', finished=time.time(),
+                           error="The server restarted before this conversion finished - please try again")
+                increment_stat('jobs_failed')
+                remove_scratch_dir(job.get('scratch_dir'))
+    
+    # Owner locks of exited processes (and the ones opened above for them)
+    for name in os.listdir(ADMISSION_FOLDER):
+        if not (name.startswith('owner.') and name.endswith('.lock')):
+            continue
+        path = os.path.join(ADMISSION_FOLDER, name)
+        with open(path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            os.remove(path)
+
+def save_job(job):
+    """Write job state atomically so other processes never see a partial file"""
+    job['updated'] = time.time()
+    tmp_path = job_path(job['id']) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, job_path(job['id']))
+
+def load_job(job_id):
+    """Load job state, or None if the ID is unknown"""
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+        return None
+    try:
+        with open(job_path(job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def update_job(job_id, **fields):
+    """Merge fields into a job's stored state"""
+    job = load_job(job_id) or {'id': job_id}
+    job.update(fields)
+    save_job(job)
+    return job
+
+def run_conversion_job(job_id, params):
+    """Entry point executed inside a pool worker process"""
+    with running_job(job_id):
+        update_job(job_id, status='running', started=time.time(), progress={'stage': 'starting'})
+        set_progress_reporter(ProgressReporter(job_id))
+        try:
+            result = process_conversion(params)
+            update_job(job_id, status='done', finished=time.time(), **result)
+            increment_stat('jobs_done')
+        except Exception as e:
+            app.logger.warning(f"Job {job_id} failed: {e}")
+            update_job(job_id, status='failed', finished=time.time(), error=str(e))
+            increment_stat('jobs_failed')
+        finally:
+            set_progress_reporter(None)
+            # The result is in the result store - nothing in scratch is needed any more
+            remove_scratch_dir(params.get('scratch_dir'))
+
+def get_executor():
+    """Return this process's worker pool, creating it on first use (after gunicorn forks)"""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        # Workers come from a fork server, not straight from this threaded process - a plain fork
+        # would copy any slot, stats or janitor lock another request thread holds at that moment,
+        # and the child would keep it locked after the parent lets go
+        context = multiprocessing.get_context('forkserver')
+        if __name__ != '__main__':
+            context.set_forkserver_preload([__name__])
+        _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=warm_up, mp_context=context)
+        _executor_pid = os.getpid()
+    return _executor
+
+def create_job(params):
+    """Create a queued job record (and its scratch directory, if params has none yet) and return its ID"""
+    job_id = uuid.uuid4().hex
+    if not params.get('scratch_dir'):
+        params['scratch_dir'] = make_scratch_dir()
+    save_job({
+        'id': job_id,
+        'status': 'queued',
+        'owner': job_owner(),
+        'created': time.time(),
+        'output_format': params.get('output_format', 'mp3'),
+        'progress': {'stage': 'queued'},
+        'scratch_dir': params['scratch_dir'],
+        # Kept so cover art can be fetched for the result later
+        'video_url': params.get('video_url'),
+    })
+    return job_id
+
+def make_scratch_dir():
+    """Create a private directory for one job's temporary files"""
+    path = os.path.join(SCRATCH_FOLDER, uuid.uuid4().hex)
+    os.makedirs(path)
+    return path
+
+def remove_scratch_dir(path):
+    """Delete a job's scratch directory and everything in it"""
+    if path and os.path.dirname(path) == SCRATCH_FOLDER:
+        shutil.rmtree(path, ignore_errors=True)
+
+def remove_after_response(response, scratch_dir):
+    """Delete scratch_dir once the response has finished streaming to the client"""
+    return after_response(response, functools.partial(remove_scratch_dir, scratch_dir))
+
+def upload_session_dir(upload_id):
+    """Scratch directory of an open resumable upload, or None if the ID is unknown (or finalized)"""
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id or ''):
+        return None
+    path = os.path.join(SCRATCH_FOLDER, upload_id)
+    return path if os.path.exists(os.path.join(path, 'upload.json')) else None
+
+def load_upload(upload_id):
+    """State of a resumable upload (name, declared size, bytes received so far), or None"""
+    path = upload_session_dir(upload_id)
+    if path is None:
+        return None
+    try:
+        with open(os.path.join(path, 'upload.json')) as f:
+            upload = json.load(f)
+        upload['received'] = os.path.getsize(upload['path'])
+    except (OSError, ValueError):
+        return None
+    return upload
+
+def upload_response(upload, status=200):
+    """Client view of a resumable upload; the Range header says which bytes the server has"""
+    upload_url = f"/uploads/{upload['id']}"
+    response = jsonify({
+        'upload_id': upload['id'],
+        'filename': upload['filename'],
+        'size': upload['size'],
+        'received': upload['received'],
+        'chunk_size': RESUMABLE_CHUNK_SIZE,
+        'upload_url': upload_url,
+        'finalize_url': f"{upload_url}/finalize",
+    })
+    response.status_code = status
+    if upload['received']:
+        response.headers['Range'] = f"bytes=0-{upload['received'] - 1}"
+    return response
+
+def parse_content_range(value):
+    """(start, end, total) from a 'bytes start-end/total' Content-Range header, or None"""
+    match = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+)', (value or '').strip())
+    if not match:
+        return None
+    start, end, total = (int(group) for group in match.groups())
+    return (start, end, total) if start <= end < total else None
+
+def disk_usage_fraction():
+    """How full the filesystem holding the temp/cache folders is (0-1)"""
+    usage = shutil.disk_usage(UPLOAD_FOLDER)
+    return usage.used / usage.total if usage.total else 0
+
+def active_scratch_dirs():
+    """Scratch directories of jobs that are still queued or running"""
+    active = set()
+    for name in os.listdir(JOBS_FOLDER):
+        job = load_job(name[:-len('.json')]) if name.endswith('.json') else None
+        if job and job.get('status') in ('queued', 'running') and job.get('scratch_dir'):
+            active.add(job['scratch_dir'])
+    return active
+
+def last_modified(path):
+    """Newest mtime of a path or, for a directory, of anything directly in it - writing into an
+    existing file (a .part download, ffmpeg output) doesn't touch the directory's own mtime"""
+    mtime = os.path.getmtime(path)
+    if os.path.isdir(path):
+        for entry in os.scandir(path):
+            try:
+                mtime = max(mtime, entry.stat(follow_symlinks=False).st_mtime)
+            except OSError:
+                pass
+    return mtime
+
+def clean_temp_files(max_age=SCRATCH_MAX_AGE):
+    """Remove scratch directories and orphaned temp files older than max_age seconds,
+    results older than RESULT_TTL (or max_age if shorter), expired video info and job records
+    older than JOB_RECORD_MAX_AGE.
+    Scratch directories of queued and running jobs are kept however old they are."""
+    now = time.time()
+    active = active_scratch_dirs()
+    targets = [(os.path.join(SCRATCH_FOLDER, name), max_age) for name in os.listdir(SCRATCH_FOLDER)
+               if os.path.join(SCRATCH_FOLDER, name) not in active]
+    targets += [(os.path.join(RESULTS_FOLDER, name), min(RESULT_TTL, max_age)) for name in os.listdir(RESULTS_FOLDER)]
+    targets += [(os.path.join(UPLOAD_FOLDER, name), max_age) for name in os.listdir(UPLOAD_FOLDER)
+                if name.startswith(ORPHAN_PREFIXES)]
+    targets += [(os.path.join(JOBS_FOLDER, name), JOB_RECORD_MAX_AGE) for name in os.listdir(JOBS_FOLDER)]
+    # Never read again once past the TTL - extract_video_info writes a fresh file instead
+    targets += [(os.path.join(INFO_CACHE_FOLDER, name), INFO_CACHE_TTL) for name in os.listdir(INFO_CACHE_FOLDER)]
+    
+    for path, age in targets:
+        try:
+            if now - last_modified(path) < age:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        except OSError:
+            # Removed by another process in the meantime
+            pass
+
+def run_janitor():
+    """One cleanup pass (skipped if another process is already running one).
+    Over the disk high-water mark it also clears younger scratch files and shrinks the source cache."""
+    with open(os.path.join(ADMISSION_FOLDER, 'janitor.lock'), 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        
+        fail_orphaned_jobs()
+        clean_temp_files()
+        if disk_usage_fraction() >= DISK_HIGH_WATER:
+            clean_temp_files(max_age=SCRATCH_MAX_AGE // 4)
+            evict_cache('source', CACHE_TIERS['source']['max_bytes'] // 2)
+
+def janitor_loop():
+    """Background thread body - fail the jobs of processes that exited before this one started,
+    then run the janitor every JANITOR_INTERVAL seconds"""
+    try:
+        fail_orphaned_jobs()
+    except Exception as e:
+        app.logger.warning(f"Orphaned job check failed: {e}")
+    while JANITOR_INTERVAL > 0:
+        time.sleep(JANITOR_INTERVAL)
+        try:
+            run_janitor()
+        except Exception as e:
+            app.logger.warning(f"Janitor pass failed: {e}")
+
+def start_janitor():
+    """Start this process's janitor thread (once per process, so again after gunicorn forks).
+    Runs before each request, so only serving processes get one - never the pool's workers."""
+    global _janitor_pid
+    if _janitor_pid != os.getpid():
+        _janitor_pid = os.getpid()
+        threading.Thread(target=janitor_loop, name='janitor', daemon=True).start()
+
+def submit_job(params, cost=1):
+    """Create a job record and queue it for the worker pool (cheaper jobs go first)"""
+    job_id = create_job(params)
+    with _scheduler_lock:
+        _pending_jobs.append((cost, time.time(), job_id, params))
+    dispatch_jobs()
+    return job_id
+
+def dispatch_jobs():
+    """Hand queued jobs to free pool workers, lowest cost first with waiting time counted against it"""
+    global _executor, _running_jobs
+    with _scheduler_lock:
+        while _pending_jobs and _running_jobs < MAX_WORKERS:
+            now = time.time()
+            job = min(_pending_jobs, key=lambda item: item[0] - (now - item[1]) / PRIORITY_AGING)
+            _pending_jobs.remove(job)
+            _, _, job_id, params = job
+            try:
+                future = get_executor().submit(run_conversion_job, job_id, params)
+            except BrokenProcessPool:
+                # A worker died and took the pool with it - start a fresh one
+                _executor = None
+                future = get_executor().submit(run_conversion_job, job_id, params)
+            _running_jobs += 1
+            future.add_done_callback(functools.partial(job_finished, job_id, params))
+
+def job_finished(job_id, params, future):
+    """Pool callback - free the job's place and start the next queued one"""
+    global _running_jobs
+    error = future.exception()
+    if error is not None:
+        # The worker died (or the job couldn't be sent to it) before run_conversion_job could record
+        # anything. Taking the job's lock also clears the one a killed worker left behind.
+        with running_job(job_id):
+            job = load_job(job_id)
+            # The janitor may have found it first
+            if job and job['status'] in ('queued', 'running'):
+                app.logger.warning(f"Job {job_id} lost its worker: {error!r}")
+                update_job(job_id, status='failed', finished=time.time(),
+                           error="The conversion worker stopped unexpectedly - please try again")
+                increment_stat('jobs_failed')
+                remove_scratch_dir(params.get('scratch_dir'))
+    
+    with _scheduler_lock:
+        _running_jobs -= 1
+    dispatch_jobs()
+
+def queued_cost():
+    """Total cost of jobs in this process waiting for a pool worker"""
+    with _scheduler_lock:
+        return sum(cost for cost, _, _, _ in _pending_jobs)
+
+def estimate_job_cost(params, upload_size=None, lookup=True):
+    """Work units for a job - minutes of media to produce, weighted by output format.
+    URL durations come from the (cached) video info unless lookup is False."""
+    output_format = params.get('output_format', 'mp3')
+    start_time, end_time = params.get('start_time'), params.get('end_time')
+    
+    duration = None
+    if params.get('input_type') == 'url' and lookup:
+        try:
+            duration = get_video_info(params['video_url']).get('duration') or None
+        except Exception:
+            # The job itself reports extraction errors
+            pass
+    elif upload_size:
+        # Very rough: about 512 kbit/s of media
+        duration = upload_size / (64 * 1024)
+    
+    if duration is not None:
+        end = min(end_time, duration) if end_time is not None else duration
+        seconds = end - (start_time or 0)
+    elif start_time is not None and end_time is not None:
+        seconds = end_time - start_time
+    else:
+        seconds = DEFAULT_JOB_MINUTES * 60
+    
+    weight = FORMAT_COST[output_format]
+    if output_format == 'mp4' and start_time is None and end_time is None:
+        # Untrimmed video is stream-copied
+        weight = 1
+    if params.get('outputs'):
+        # One decode feeds every output, but each one is encoded
+        weight = sum(1 if output['format'] == 'mp4' and output['start_time'] is None and output['end_time'] is None
+                     else FORMAT_COST[output['format']] for output in params['outputs'])
+    return round(max(1, max(seconds, 0) / 60 * weight), 1)
+
+def take_tokens(client, cost):
+    """Charge cost units to a client's token bucket (shared by all processes).
+    Returns 0 if granted, otherwise the seconds until enough units will be available."""
+    if RATE_LIMIT_PER_MINUTE <= 0:
+        return 0
+    refill = RATE_LIMIT_PER_MINUTE / 60
+    
+    with open(RATE_FILE + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(RATE_FILE) as f:
+                buckets = json.load(f)
+        except (OSError, ValueError):
+            buckets = {}
+        
+        now = time.time()
+        tokens, updated = buckets.get(client, (RATE_LIMIT_BURST, now))
+        tokens = min(RATE_LIMIT_BURST, tokens + (now - updated) * refill)
+        # Work bigger than the whole bucket needs a full one and is paid off afterwards -
+        # the bucket goes negative, so the client waits for the rest of the cost to refill
+        needed = min(cost, RATE_LIMIT_BURST)
+        wait = 0 if tokens >= needed else (needed - tokens) / refill
+        buckets[client] = (tokens - cost if not wait else tokens, now)
+        
+        # Forget clients whose buckets have refilled completely
+        buckets = {key: value for key, value in buckets.items()
+                   if value[0] + (now - value[1]) * refill < RATE_LIMIT_BURST}
+        tmp_path = RATE_FILE + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(buckets, f)
+        os.replace(tmp_path, RATE_FILE)
+    return wait
+
+def take_stream_slot():
+    """Reserve one of this worker's MAX_STREAMS long-lived stream slots. Returns a function that
+    gives it back (hand it to after_response), or None if all are in use."""
+    if not _stream_slots.acquire(blocking=False):
+        return None
+    return _stream_slots.release
+
+def streams_busy():
+    """429 response for when every long-lived stream slot is in use"""
+    return too_many_requests("Too many progress streams and downloads are open. Please try again shortly.", 5)
+
+def too_many_requests(message, retry_after):
+    """429 response telling the client when to come back"""
+    retry_after = max(1, math.ceil(retry_after))
+    response = jsonify({'error': message, 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def admission_response(cost, queued=True, writes_disk=True):
+    """None if the request may go ahead, otherwise a 429 response.
+    Charges cost to the client's token bucket; queued work also needs room in the job queue,
+    and anything that writes files is paused while the disk is over its high-water mark."""
+    if writes_disk and disk_usage_fraction() >= DISK_HIGH_WATER:
+        # Let the janitor make room, but don't take on more files until it has
+        threading.Thread(target=run_janitor, daemon=True).start()
+        return too_many_requests("The server is low on disk space. Please try again shortly.", BUSY_RETRY_AFTER)
+    
+    if queued:
+        waiting = queued_cost()
+        if waiting and waiting + cost > MAX_QUEUED_COST:
+            return too_many_requests("The converter is busy right now. Please try again shortly.", BUSY_RETRY_AFTER)
+    
+    wait = take_tokens(request.remote_addr or 'unknown', cost)
+    if wait:
+        return too_many_requests(f"Too many requests. Please wait {math.ceil(wait)} seconds and try again.", wait)
+    return None
+
+def settle_job_cost(params, provisional, upload_size=None):
+    """Price a job admitted on a provisional estimate, now that reading its form and looking up
+    a URL's duration are allowed, and charge or refund the difference. Returns (cost, None),
+    or (cost, 429 response) if the client's bucket can't cover the extra."""
+    cost = estimate_job_cost(params, upload_size=upload_size)
+    if cost == provisional:
+        return cost, None
+    wait = take_tokens(request.remote_addr or 'unknown', cost - provisional)
+    if wait:
+        return cost, too_many_requests(f"Too many requests. Please wait {math.ceil(wait)} seconds and try again.", wait)
+    return cost, None
+
+def public_job(job):
+    """Job fields that are safe to return to the client"""
+    data = {key: job.get(key) for key in ('id', 'status', 'created', 'started', 'finished', 'error', 'download_filename', 'conversion', 'progress', 'expires')}
+    if job.get('outputs'):
+        data['outputs'] = [
+            dict({key: result.get(key) for key in ('format', 'bitrate', 'download_filename', 'mimetype')},
+                 result_url=f"/jobs/{job['id']}/result/{index}")
+            for index, result in enumerate(job['outputs'])
+        ]
+    return data
+
+def tag_fields(values):
+    """The ID3 tag fields present in submitted JSON (an empty string means remove the tag)"""
+    return {key: str(values[key]) for key in ID3_FRAMES
+            if isinstance(values.get(key), (str, int)) and not isinstance(values.get(key), bool)}
+
+def job_cover_art(job):
+    """Cover art for a job's result, from the thumbnail of the video it was converted from"""
+    if not job.get('video_url'):
+        raise Exception("Cover art comes from the video's thumbnail, so it needs a URL conversion")
+    return fetch_cover_art(job['video_url'])
+
+def retag_result(job, fields, cover=None):
+    """Change the tags of a finished job's MP3 results in place, without converting again.
+    Returns the updated job record."""
+    results = job.get('outputs') or [dict(job, format=job.get('output_format'), label='')]
+    if job.get('status') != 'done' or not all(os.path.exists(result.get('output_path') or '') for result in results):
+        raise Exception("This result is not available - convert the video again")
+    tagged = [result for result in results if result['format'] in ('mp3', 'preview')]
+    if not tagged:
+        raise Exception("Tags can only be edited on MP3 results")
+    
+    with open(os.path.join(ADMISSION_FOLDER, 'tags.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with timed_stage('id3'):
+            for result in tagged:
+                output_path = result['output_path']
+                if os.stat(output_path).st_nlink > 1:
+                    # Still the result cache's file - write a tagged private copy over the link
+                    tmp_path = f"{output_path}.{uuid.uuid4().hex[:8]}.tmp"
+                    copy_with_id3_tags(output_path, tmp_path, fields, cover)
+                    os.replace(tmp_path, output_path)
+                else:
+                    write_id3_tags(output_path, fields, cover)
+    
+    # The edit restarts the results' time in the store
+    expires = time.time() + RESULT_TTL
+    for result in results:
+        result['expires'] = expires
+        if fields.get('title'):
+            ext = os.path.splitext(result['download_filename'])[1]
+            result['download_filename'] = f"{sanitize_filename(fields['title'])}{result['label']}{ext}"
+    
+    changes = {'expires': expires, 'download_filename': results[0]['download_filename']}
+    if job.get('outputs'):
+        changes['outputs'] = results
+    return update_job(job['id'], **changes)
+
+class ZipStream:
+    """Write-only file object that collects ZIP output so it can be yielded piece by piece"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_batch_zip(jobs):
+    """Yield a ZIP of the jobs' results, adding each file as soon as its job finishes.
+    jobs maps job ID to track number."""
+    buffer = ZipStream()
+    pending = dict(jobs)
+    failures = []
+    deadline = time.time() + JOB_WAIT_TIMEOUT
+    
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zf:
+        while pending and time.time() < deadline:
+            finished = False
+            for job_id, track in sorted(pending.items(), key=lambda item: item[1]):
+                job = load_job(job_id)
+                if not job or job['status'] not in ('done', 'failed'):
+                    continue
+                del pending[job_id]
+                finished = True
+                
+                if job['status'] == 'failed' or not os.path.exists(job.get('output_path') or ''):
+                    failures.append(f"Track {track}: {job.get('error') or 'result file missing'}")
+                    continue
+                
+                for result in job.get('outputs') or [job]:
+                    entry = zipfile.ZipInfo(f"{track:02d} - {result['download_filename']}", time.localtime()[:6])
+                    with open(result['output_path'], 'rb') as src, zf.open(entry, 'w') as dest:
+                        for chunk in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b''):
+                            dest.write(chunk)
+                            yield buffer.drain()
+                yield buffer.drain()
+            
+            if pending and not finished:
+                time.sleep(0.5)
+        
+        for track in sorted(pending.values()):
+            failures.append(f"Track {track}: not finished after {JOB_WAIT_TIMEOUT} seconds")
+        if failures:
+            zf.writestr('errors.txt', '\n'.join(failures) + '\n')
+    
+    yield buffer.drain()
+
+def output_label(output, start_time=None, end_time=None):
+    """File name suffix that tells a multi-output job's files apart"""
+    parts = []
+    if output['format'] in EXTRA_OUTPUTS:
+        parts.append(output['format'])
+    if output['bitrate']:
+        parts.append(output['bitrate'])
+    if output['format'] != 'preview' and (output['start_time'], output['end_time']) != (start_time, end_time):
+        end = 'end' if output['end_time'] is None else f"{int(output['end_time'])}s"
+        parts.append(f"{int(output['start_time'] or 0)}s-{end}")
+    return f" ({', '.join(parts)})" if parts else ''
+
+def parse_outputs(value, start_time=None, end_time=None):
+    """Normalise a multi-output request - a list (or JSON list) whose items are a format name,
+    'format:bitrate' (e.g. 'mp3:128k') or an object with format, bitrate, start_time and end_time.
+    Trims default to the job's own; a preview is PREVIEW_SECONDS long from its start."""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise Exception("outputs must be a JSON list")
+    if not isinstance(value, list) or not value:
+        raise Exception("outputs must be a non-empty list")
+    if len(value) > MAX_OUTPUTS:
+        raise Exception(f"At most {MAX_OUTPUTS} outputs can be made at once")
+    
+    outputs = []
+    for item in value:
+        if isinstance(item, str):
+            output_format, _, bitrate = item.partition(':')
+            item = {'format': output_format, 'bitrate': bitrate}
+        if not isinstance(item, dict):
+            raise Exception("Each output must be a format name or an object")
+        
+        output_format = str(item.get('format') or '').strip().lower()
+        if output_format not in OUTPUT_FORMATS and output_format not in EXTRA_OUTPUTS:
+            raise Exception(f"Unsupported output format '{output_format}'")
+        bitrate = str(item.get('bitrate') or '').strip().lower() or None
+        if bitrate and (output_format not in ('mp3', 'm4a', 'preview') or bitrate not in OUTPUT_BITRATES):
+            raise Exception(f"Bitrate must be one of {', '.join(OUTPUT_BITRATES)} (MP3/M4A outputs only)")
+        
+        start = parse_time_to_seconds(str(item['start_time'])) if 'start_time' in item else start_time
+        end = parse_time_to_seconds(str(item['end_time'])) if 'end_time' in item else end_time
+        if output_format == 'preview':
+            start = start or 0
+            end = start + PREVIEW_SECONDS if end is None else min(end, start + PREVIEW_SECONDS)
+        if start is not None and end is not None and end <= start:
+            raise Exception("An output's end time must be after its start time")
+        
+        output = {'format': output_format, 'bitrate': bitrate, 'start_time': start, 'end_time': end}
+        if output not in outputs:
+            outputs.append(output)
+    
+    for output in outputs:
+        output['label'] = output_label(output, start_time, end_time)
+    return outputs
+
+def conversion_params(values):
+    """Build job parameters from submitted form (or query string) values"""
+    output_format = values.get('output_format', 'mp3')
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception(f"Unsupported output format '{output_format}'")
+    
+    preset = values.get('preset', '').strip() or DEFAULT_PRESET
+    if preset not in ALLOWED_PRESETS:
+        raise Exception(f"Unknown quality preset '{preset}'. Choose one of: {', '.join(ALLOWED_PRESETS)}")
+    
+    start_time = parse_time_to_seconds(values.get('start_time', ''))
+    end_time = parse_time_to_seconds(values.get('end_time', ''))
+    
+    return {
+        'input_type': values.get('input_type', 'file'),
+        'output_format': output_format,
+        'start_time': start_time,
+        'end_time': end_time,
+        'preset': preset,
+        # Several outputs from one download and one ffmpeg run (see parse_outputs)
+        'outputs': parse_outputs(values['outputs'], start_time, end_time) if values.get('outputs') else None,
+        # Metadata fields (for MP3 only)
+        'meta': {
+            'title': values.get('meta_title', '').strip(),
+            'artist': values.get('meta_artist', '').strip(),
+            'album': values.get('meta_album', '').strip(),
+            'album_artist': values.get('meta_album_artist', '').strip(),
+            'genre': values.get('meta_genre', '').strip(),
+            'track': values.get('meta_track', '').strip(),
+            'year': values.get('meta_year', '').strip(),
+            'comment': values.get('meta_comment', '').strip(),
+        },
+    }
+
+def job_response(job_id):
+    """202 response pointing the client at a job's status and result"""
+    job = load_job(job_id)
+    return jsonify({
+        'job_id': job_id,
+        'status': job['status'] if job else 'queued',
+        'status_url': f"/jobs/{job_id}",
+        'events_url': f"/jobs/{job_id}/events",
+        'result_url': f"/jobs/{job_id}/result",
+    }), 202
+
+@app.route('/fetch-info/batch', methods=['POST'])
+def fetch_info_batch():
+    """Fetch info for a list of URLs and/or every entry of a playlist"""
+    try:
+        data = request.get_json() or {}
+        urls = [url.strip() for url in data.get('urls', []) if isinstance(url, str) and url.strip()]
+        playlist = (data.get('playlist') or '').strip()
+        
+        rejected = admission_response(INFO_REQUEST_COST * (len(urls) + (1 if playlist else 0)), queued=False,
+                                      writes_disk=False)
+        if rejected:
+            return rejected
+        
+        if playlist:
+            urls.extend(list_playlist_urls(playlist)[0])
+        
+        if not urls:
+            return jsonify({'error': 'Please enter at least one video URL'}), 400
+        
+        return jsonify({'items': get_video_infos(urls[:BATCH_MAX_ITEMS])})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/convert', methods=['POST'])
+def convert():
+    """Queue a video to MP3 or MP4 conversion and return its job ID"""
+    try:
+        # Admission comes first, priced on the body size alone - reading the form parses the whole
+        # multipart upload to disk, and a URL's duration lookup is a full extraction
+        provisional = estimate_job_cost({}, upload_size=request.content_length)
+        rejected = admission_response(provisional)
+        if rejected:
+            return rejected
+        
+        params = conversion_params(request.form)
+        
+        if params['input_type'] == 'url':
+            # Handle URL input
+            video_url = request.form.get('video_url', '').strip()
+            
+            if not video_url:
+                return jsonify({'error': 'Please enter a video URL'}), 400
+            
+            params['video_url'] = video_url
+            cost, rejected = settle_job_cost(params, provisional)
+        else:
+            # Handle file upload - save it so the worker process can read it
+            video_file = request.files.get('video')
+            
+            if not video_file or video_file.filename == '':
+                return jsonify({'error': 'Please select a video file'}), 400
+            cost, rejected = settle_job_cost(params, provisional, upload_size=request.content_length)
+        
+        if rejected:
+            return rejected
+        
+        if params['input_type'] != 'url':
+            filename = secure_filename(video_file.filename)
+            params['scratch_dir'] = make_scratch_dir()
+            upload_path = os.path.join(params['scratch_dir'], f"upload_{filename}")
+            video_file.save(upload_path)
+            params['upload_path'] = upload_path
+            params['upload_name'] = filename
+        
+        return job_response(submit_job(params, cost))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/convert/stream', methods=['POST'])
+def convert_stream():
+    """Convert a raw file upload (request body), starting ffmpeg while the file is still arriving.
+    Options are passed in the query string, with the original file name in 'filename'."""
+    try:
+        params = conversion_params(request.args)
+        params['input_type'] = 'file'
+        filename = secure_filename(request.args.get('filename', ''))
+        
+        if not filename:
+            return jsonify({'error': 'Please select a video file'}), 400
+        params['upload_name'] = filename
+        
+        # Checked before reading the body, so a rejected upload isn't received at all
+        cost = estimate_job_cost(params, upload_size=request.content_length)
+        rejected = admission_response(cost)
+        if rejected:
+            return rejected
+        
+        head = request.stream.read(UPLOAD_CHUNK_SIZE)
+        if not head:
+            return jsonify({'error': 'Please select a video file'}), 400
+        
+        slot = None
+        if params['output_format'] == 'mp3' and not params['outputs'] and can_stream_upload(filename, head):
+            slot = acquire_slot('encode', wait=False)
+        
+        if slot is None:
+            # Container needs seeking (e.g. MP4 with moov at the end), or every encoder
+            # is busy - spool to disk and queue
+            params['scratch_dir'] = make_scratch_dir()
+            upload_path = os.path.join(params['scratch_dir'], f"upload_{filename}")
+            with open(upload_path, 'wb') as f:
+                f.write(head)
+                shutil.copyfileobj(request.stream, f, UPLOAD_CHUNK_SIZE)
+            params['upload_path'] = upload_path
+            return job_response(submit_job(params, cost))
+        
+        try:
+            job_id = create_job(params)
+            with running_job(job_id):
+                stream_conversion(job_id, params, head, request.stream)
+        finally:
+            slot.close()
+        return job_response(job_id)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start a resumable upload. Takes JSON with 'filename' and 'size' (bytes); the file is then
+    sent in ranged PUTs to upload_url and converted by POSTing the /convert fields to finalize_url."""
+    try:
+        data = request.get_json() or {}
+        filename = secure_filename(str(data.get('filename') or ''))
+        size = data.get('size')
+        
+        if not filename:
+            return jsonify({'error': 'Please select a video file'}), 400
+        if not isinstance(size, int) or size <= 0:
+            return jsonify({'error': 'Upload size must be a positive number of bytes'}), 400
+        if size > shutil.disk_usage(SCRATCH_FOLDER).free:
+            return jsonify({'error': 'This file is too large to upload right now'}), 413
+        
+        rejected = admission_response(INFO_REQUEST_COST, queued=False)
+        if rejected:
+            return rejected
+        
+        scratch_dir = make_scratch_dir()
+        upload = {
+            'id': os.path.basename(scratch_dir),
+            'filename': filename,
+            'size': size,
+            'path': os.path.join(scratch_dir, f"upload_{filename}"),
+            'created': time.time(),
+        }
+        open(upload['path'], 'wb').close()
+        with open(os.path.join(scratch_dir, 'upload.json'), 'w') as f:
+            json.dump(upload, f)
+        
+        upload['received'] = 0
+        return upload_response(upload, 201)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/uploads/<upload_id>')
+def upload_status(upload_id):
+    """How much of a resumable upload has arrived - where the client should resume from"""
+    upload = load_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    return upload_response(upload)
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Store one chunk of a resumable upload. The body is the bytes given by the Content-Range
+    header; a chunk may repeat bytes already received but may not leave a gap."""
+    upload = load_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    span = parse_content_range(request.headers.get('Content-Range'))
+    if span is None or span[2] != upload['size']:
+        return jsonify({'error': f"Content-Range must be 'bytes start-end/{upload['size']}'"}), 400
+    start, end, _ = span
+    if request.content_length != end - start + 1:
+        return jsonify({'error': 'Chunk length does not match its Content-Range'}), 400
+    if start > upload['received']:
+        # A gap - tell the client where to carry on from
+        return upload_response(upload, 409)
+    
+    if disk_usage_fraction() >= DISK_HIGH_WATER:
+        threading.Thread(target=run_janitor, daemon=True).start()
+        return too_many_requests("The server is low on disk space. Please try again shortly.", BUSY_RETRY_AFTER)
+    
+    with open(upload['path'], 'r+b') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(start)
+        remaining = end - start + 1
+        try:
+            while remaining > 0:
+                chunk = request.stream.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+        except ClientDisconnected:
+            # Keep what did arrive - the client resumes from the new offset
+            pass
+    
+    # Activity keeps the janitor away from uploads that are still in progress
+    os.utime(os.path.dirname(upload['path']))
+    upload['received'] = os.path.getsize(upload['path'])
+    return upload_response(upload)
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    """Abandon a resumable upload and delete what was received"""
+    path = upload_session_dir(upload_id)
+    if path is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    remove_scratch_dir(path)
+    return '', 204
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """Queue a completed resumable upload for conversion. Takes the same form fields as /convert."""
+    try:
+        upload = load_upload(upload_id)
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+        if upload['received'] != upload['size']:
+            return upload_response(upload, 409)
+        
+        params = conversion_params(request.form)
+        params['input_type'] = 'file'
+        cost = estimate_job_cost(params, upload_size=upload['size'])
+        rejected = admission_response(cost)
+        if rejected:
+            return rejected
+        
+        # Removing the session record first means a repeated finalize can't queue it twice
+        try:
+            os.remove(os.path.join(os.path.dirname(upload['path']), 'upload.json'))
+        except FileNotFoundError:
+            return jsonify({'error': 'Upload not found'}), 404
+        
+        params['scratch_dir'] = os.path.dirname(upload['path'])
+        params['upload_path'] = upload['path']
+        params['upload_name'] = upload['filename']
+        return job_response(submit_job(params, cost))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/convert/batch', methods=['POST'])
+def convert_batch():
+    """Convert a playlist and/or list of URLs in parallel and stream back a ZIP of the results.
+    Takes JSON with 'urls' and/or 'playlist' plus the usual /convert fields; track numbers are
+    assigned in order and other tags are filled from each video's info."""
+    release_stream = None
+    try:
+        data = request.get_json() or {}
+        params = conversion_params(data)
+        urls = [url.strip() for url in data.get('urls', []) if isinstance(url, str) and url.strip()]
+        playlist = (data.get('playlist') or '').strip()
+        
+        if playlist:
+            playlist_urls, playlist_title = list_playlist_urls(playlist)
+            urls.extend(playlist_urls)
+            if playlist_title and not params['meta']['album']:
+                params['meta']['album'] = playlist_title
+        
+        if not urls:
+            return jsonify({'error': 'Please enter at least one video URL'}), 400
+        urls = urls[:BATCH_MAX_ITEMS]
+        
+        # The ZIP streams until every job is done, so it needs a stream slot before any work starts
+        release_stream = take_stream_slot()
+        if release_stream is None:
+            return streams_busy()
+        
+        # Durations aren't looked up for every entry - each counts as a default-length job
+        job_cost = estimate_job_cost(dict(params, input_type='url'), lookup=False)
+        rejected = admission_response(job_cost * len(urls))
+        if rejected:
+            release_stream()
+            return rejected
+        
+        jobs = {}
+        for track, url in enumerate(urls, start=1):
+            job_params = dict(params, input_type='url', video_url=url, auto_tags=True)
+            job_params['meta'] = dict(params['meta'], track=f"{track}/{len(urls)}")
+            jobs[submit_job(job_params, job_cost)] = track
+        
+        name = sanitize_filename(params['meta']['album'] or 'converted_tracks') or 'converted_tracks'
+        response = Response(stream_with_context(count_bytes_out(stream_batch_zip(jobs))), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(name)}.zip"
+        response.headers['X-Batch-Jobs'] = ','.join(jobs)
+        return after_response(response, release_stream)
+        
+    except Exception as e:
+        if release_stream is not None:
+            release_stream()
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/convert/live')
+def convert_live():
+    """Stream an MP3 of a URL to the client while ffmpeg is still encoding it.
+    Takes the same fields as /convert in the query string; the browser can save it progressively."""
+    scratch_dir = None
+    try:
+        params = conversion_params(request.args)
+        video_url = request.args.get('video_url', '').strip()
+        
+        if not video_url:
+            return jsonify({'error': 'Please enter a video URL'}), 400
+        params.update(input_type='url', video_url=video_url, output_format='mp3')
+        
+        # Admitted on a default-length estimate - the duration lookup is a full extraction
+        cost = estimate_job_cost(params, lookup=False)
+        rejected = admission_response(cost, queued=False)
+        if rejected:
+            return rejected
+        _, rejected = settle_job_cost(params, cost)
+        if rejected:
+            return rejected
+        
+        scratch_dir = make_scratch_dir()
+        params['scratch_dir'] = scratch_dir
+        
+        # Already converted - send the finished file
+        key = result_cache_key(canonical_video_id(video_url), 'mp3', params['start_time'], params['end_time'],
+                               params['preset'])
+        entry = cache_get('result', key)
+        if entry is not None:
+            result = deliver_output(params, entry, scratch_dir)
+            response = send_file(
+                result['output_path'],
+                as_attachment=True,
+                download_name=result['download_filename'],
+                mimetype=result['mimetype']
+            )
+            track_send(response, os.path.getsize(result['output_path']))
+            return remove_after_response(response, scratch_dir)
+        
+        # A live stream can't wait in the queue - it needs an encoder now. It takes one before
+        # fetching anything, so a busy server refuses without downloading the source for nothing.
+        slot = acquire_slot('encode', wait=False)
+        if slot is None:
+            return too_many_requests("All converters are busy right now. Please try again shortly.", BUSY_RETRY_AFTER)
+        
+        try:
+            # Encode from the cached source, or let ffmpeg read the media URL directly
+            headers = None
+            source = find_source(video_url, 'audio')
+            if source is None:
+                direct = get_audio_stream_url(video_url)
+                if direct:
+                    input_path, headers, title = direct
+                else:
+                    source = fetch_source(video_url, 'audio', scratch_dir)
+            if source is not None:
+                input_path, title = source['path'], source['title']
+            
+            if params['meta']['title']:
+                title = sanitize_filename(params['meta']['title'])
+            
+            cmd = mp3_ffmpeg_cmd(input_path, 'pipe:1', params['start_time'], params['end_time'],
+                                 metadata=params['meta'], input_headers=headers, preset=params['preset'])
+            chunks = stream_ffmpeg_output(cmd)
+        except Exception:
+            slot.close()
+            raise
+        
+        response = Response(stream_with_context(count_bytes_out(chunks)), mimetype='audio/mpeg')
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(title)}.mp3"
+        response.headers['Cache-Control'] = 'no-store'
+        after_response(response, slot.close)
+        return remove_after_response(response, scratch_dir)
+        
+    except Exception as e:
+        remove_scratch_dir(scratch_dir)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Hit/miss counters and current size of each cache tier"""
+    stats = read_stats()
+    report = {}
+    for tier, config in CACHE_TIERS.items():
+        usage = cache_usage(tier)
+        report[tier] = {
+            'hits': stats.get(f"{tier}_cache_hits", 0),
+            'misses': stats.get(f"{tier}_cache_misses", 0),
+            'evictions': stats.get(f"{tier}_cache_evictions", 0),
+            'entries': len(usage),
+            'size_bytes': sum(size for _, size, _ in usage),
+            'max_bytes': config['max_bytes'],
+        }
+    report['info'] = {
+        'hits': stats.get('info_cache_hits', 0),
+        'misses': stats.get('info_cache_misses', 0),
+        'entries': fresh_info_entries(),
+        'ttl_seconds': INFO_CACHE_TTL,
+    }
+    return jsonify(report)
+
+def job_state_counts():
+    """Number of job records in each status (shared by all processes)"""
+    counts = {'queued': 0, 'running': 0}
+    for name in os.listdir(JOBS_FOLDER):
+        if not name.endswith('.json'):
+            continue
+        job = load_job(name[:-5])
+        if job and job.get('status') in counts:
+            counts[job['status']] += 1
+    return counts
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text-format metrics: stage timings, fallbacks, bytes, cache and queue state"""
+    stats = read_stats()
+    lines = []
+    
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    
+    lines.append("# HELP converter_stage_duration_seconds Time spent in each pipeline stage")
+    lines.append("# TYPE converter_stage_duration_seconds histogram")
+    for stage, histogram in sorted(stats.get('stage_seconds', {}).items()):
+        cumulative = 0
+        for bound, count in zip(STAGE_BUCKETS, histogram['buckets']):
+            cumulative += count
+            lines.append(f'converter_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'converter_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'converter_stage_duration_seconds_sum{{stage="{stage}"}} {round(histogram["sum"], 3)}')
+        lines.append(f'converter_stage_duration_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+    
+    def prefixed(prefix, label):
+        return [({label: name[len(prefix):]}, value) for name, value in sorted(stats.items()) if name.startswith(prefix)]
+    
+    metric('converter_stage_failures_total', 'counter', 'Stage runs that raised an error',
+           prefixed('stage_failures_', 'stage'))
+    metric('converter_fallbacks_total', 'counter', 'Fallback paths taken', prefixed('fallback_', 'path'))
+    metric('converter_jobs_total', 'counter', 'Finished conversion jobs by outcome', prefixed('jobs_', 'status'))
+    metric('converter_bytes_in_total', 'counter', 'Media bytes received (uploads and downloads)',
+           prefixed('bytes_in_', 'source'))
+    metric('converter_bytes_out_total', 'counter', 'Bytes sent to clients', [({}, stats.get('bytes_out', 0))])
+    metric('converter_id3_tag_failures_total', 'counter', 'MP3 files that could not be tagged',
+           [({}, stats.get('id3_tag_failures', 0))])
+    metric('converter_ffmpeg_input_errors_total', 'counter', 'Conversions refused as unreadable input (no fallback tried)',
+           [({}, stats.get('ffmpeg_input_errors', 0))])
+    
+    tiers = list(CACHE_TIERS) + ['info']
+    for event in ('hits', 'misses', 'evictions'):
+        metric(f"converter_cache_{event}_total", 'counter', f"Cache {event} per tier",
+               [({'tier': tier}, stats.get(f"{tier}_cache_{event}", 0)) for tier in tiers])
+    usage = {tier: cache_usage(tier) for tier in CACHE_TIERS}
+    metric('converter_cache_size_bytes', 'gauge', 'Bytes held in each cache tier',
+           [({'tier': tier}, sum(size for _, size, _ in entries)) for tier, entries in usage.items()])
+    metric('converter_cache_entries', 'gauge', 'Entries in each cache tier',
+           [({'tier': tier}, len(entries)) for tier, entries in usage.items()]
+           + [({'tier': 'info'}, fresh_info_entries())])
+    metric('converter_cache_max_bytes', 'gauge', 'Size budget of each cache tier',
+           [({'tier': tier}, config['max_bytes']) for tier, config in CACHE_TIERS.items()])
+    
+    metric('converter_jobs', 'gauge', 'Jobs currently queued or running (all processes)',
+           [({'state': state}, count) for state, count in job_state_counts().items()])
+    metric('converter_queued_cost', 'gauge', 'Work units waiting for a pool worker in this process',
+           [({}, queued_cost())])
+    metric('converter_disk_usage_ratio', 'gauge', 'Fraction of the temp filesystem in use',
+           [({}, round(disk_usage_fraction(), 4))])
+    
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the status of a conversion job"""
+    job = load_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(public_job(job))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events stream of a job's status and progress, until it finishes"""
+    if not load_job(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    release_stream = take_stream_slot()
+    if release_stream is None:
+        # The page falls back to polling /jobs/<id>
+        return streams_busy()
+    
+    def generate():
+        last_sent = None
+        last_write = time.time()
+        # The client reconnects if the job is still going - this only bounds one connection
+        deadline = last_write + JOB_WAIT_TIMEOUT
+        while time.time() < deadline:
+            job = load_job(job_id)
+            if job is None:
+                break
+            
+            data = public_job(job)
+            if data != last_sent:
+                yield f"data: {json.dumps(data)}\n\n"
+                last_sent = data
+                last_write = time.time()
+            elif time.time() - last_write > 15:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                last_write = time.time()
+            
+            if job['status'] in ('done', 'failed'):
+                break
+            time.sleep(PROGRESS_INTERVAL)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return after_response(response, release_stream)
+
+@app.route('/jobs/<job_id>/result')
+@app.route('/jobs/<job_id>/result/<int:index>')
+def job_result(job_id, index=None):
+    """Download the output file of a finished job, or one of its outputs by index"""
+    job = load_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job['status'] == 'failed':
+        return jsonify({'error': job.get('error') or 'Conversion failed'}), 400
+    if job['status'] != 'done':
+        return jsonify({'error': 'Job is not finished yet', 'status': job['status']}), 409
+    
+    result = job
+    if index is not None:
+        outputs = job.get('outputs') or [job]
+        if index >= len(outputs):
+            return jsonify({'error': 'Output not found'}), 404
+        result = outputs[index]
+    
+    if not os.path.exists(result['output_path']):
+        return jsonify({'error': 'Result file is no longer available'}), 410
+    
+    # Send the file to user with proper filename. Conditional responses give an ETag and
+    # Range support, so an interrupted download resumes instead of starting over.
+    response = send_file(
+        result['output_path'],
+        as_attachment=True,
+        download_name=result['download_filename'],
+        mimetype=result['mimetype'],
+        conditional=True,
+        etag=True,
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    # Only what is actually sent - a range, or nothing for HEAD and 304 Not Modified
+    sent = 0 if request.method == 'HEAD' or response.status_code == 304 else response.content_length
+    return track_send(response, sent or 0)
+
+@app.route('/jobs/<job_id>/tags', methods=['POST'])
+def edit_tags(job_id):
+    """Change the ID3 tags of a finished MP3 result without converting it again. Takes JSON with any
+    of the meta fields (title, artist, album, album_artist, genre, track, year, comment - an empty
+    string removes one) and 'cover': true to use the video's thumbnail as cover art."""
+    job = load_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    try:
+        data = request.get_json() or {}
+        rejected = admission_response(INFO_REQUEST_COST, queued=False)
+        if rejected:
+            return rejected
+        
+        cover = job_cover_art(job) if data.get('cover') else None
+        return jsonify(public_job(retag_result(job, tag_fields(data), cover)))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/tags/batch', methods=['POST'])
+def edit_tags_batch():
+    """Retag many finished MP3 results at once. Takes JSON with
+    - 'results': job IDs, or objects with 'job_id' plus that track's own tag fields
+    - 'album': tag fields applied to every track (album, album_artist, year, genre, ...)
+    - 'number_tracks': true to set track numbers (n/total) in list order
+    - 'cover': 'track' for each track's own thumbnail, or 'album' for the first track's on all"""
+    try:
+        data = request.get_json() or {}
+        items = [{'job_id': item} if isinstance(item, str) else item
+                 for item in data.get('results', []) if isinstance(item, (str, dict))][:BATCH_MAX_ITEMS]
+        cover_mode = data.get('cover') or None
+        
+        if not items:
+            return jsonify({'error': 'Please list the results to tag'}), 400
+        if cover_mode not in (None, 'track', 'album'):
+            return jsonify({'error': "cover must be 'track' or 'album'"}), 400
+        
+        rejected = admission_response(INFO_REQUEST_COST * len(items), queued=False)
+        if rejected:
+            return rejected
+        
+        album_fields = tag_fields(data.get('album') or {})
+        jobs = [load_job(str(item.get('job_id') or '')) for item in items]
+        
+        # Thumbnails are fetched up front, in parallel; an album cover is fetched once
+        def cover_for(job):
+            try:
+                return job_cover_art(job)
+            except Exception as e:
+                return e
+        
+        covers = [None] * len(jobs)
+        if cover_mode == 'track':
+            with ThreadPoolExecutor(max_workers=INFO_WORKERS) as pool:
+                covers = list(pool.map(lambda job: cover_for(job) if job else None, jobs))
+        elif cover_mode == 'album':
+            source = next((job for job in jobs if job and job.get('video_url')), None)
+            if source is None:
+                return jsonify({'error': "Cover art comes from the video's thumbnail, so it needs URL conversions"}), 400
+            covers = [job_cover_art(source)] * len(jobs)
+        
+        results = []
+        for index, (item, job, cover) in enumerate(zip(items, jobs, covers), start=1):
+            try:
+                if not job:
+                    raise Exception('Job not found')
+                if isinstance(cover, Exception):
+                    raise cover
+                fields = dict(album_fields, **tag_fields(item))
+                if data.get('number_tracks'):
+                    fields['track'] = f"{index}/{len(items)}"
+                job = retag_result(job, fields, cover)
+                results.append({'job_id': job['id'], 'status': 'done', 'download_filename': job['download_filename']})
+            except Exception as e:
+                results.append({'job_id': item.get('job_id'), 'status': 'failed', 'error': str(e)})
+        
+        return jsonify({'results': results})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+app.before_request(start_janitor)
+
 if __name__ == '__main__':
     app.run(debug=True)
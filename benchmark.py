@@ -0,0 +1,436 @@
+"""Benchmark the conversion hot paths against synthetic local media.
+
+Generates test media with ffmpeg's lavfi sources, then drives the pipeline
+functions and the Flask endpoints at several concurrency levels and reports
+throughput, latency percentiles, peak RSS and disk I/O. Runs fully offline:
+URL conversions are served by a local HTTP file server instead of yt-dlp
+reaching the network.
+
+    python benchmark.py                                # default matrix
+    python benchmark.py --durations 10,120 --concurrency 1,2,4
+    python benchmark.py --scenarios mp3,upload --save-baseline baseline.json
+    python benchmark.py --baseline baseline.json       # compare, exit 1 on regression
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+# Synthetic media: container -> ffmpeg output options (video uses testsrc2, audio a sine tone)
+MEDIA_TYPES = {
+    'mp4': {'video': True, 'args': ['-c:v', 'libx264', '-preset', 'ultrafast', '-g', '50',
+                                    '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart']},
+    'mkv': {'video': True, 'args': ['-c:v', 'libx264', '-preset', 'ultrafast', '-g', '50',
+                                    '-c:a', 'libmp3lame', '-b:a', '128k']},
+    'mp3': {'video': False, 'args': ['-c:a', 'libmp3lame', '-b:a', '192k']},
+    'm4a': {'video': False, 'args': ['-c:a', 'aac', '-b:a', '128k']},
+    'wav': {'video': False, 'args': ['-c:a', 'pcm_s16le']},
+}
+
+# Scenario -> media types it runs against
+SCENARIOS = {
+    'trim': ['mp4', 'mkv'],
+    'mp3': ['mp4', 'mp3', 'm4a', 'wav'],
+    'fallback': ['mp4', 'wav'],
+    'id3': ['mp3'],
+    'upload': ['mp4', 'mp3'],
+    'url': ['mp4', 'm4a'],
+}
+DEFAULT_SCENARIOS = 'trim,mp3,id3,upload,url'
+
+# Relative change in p50 latency or throughput that counts as a regression
+DEFAULT_THRESHOLD = 0.15
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler with single-range support, enough for yt-dlp's downloaders"""
+    
+    def send_head(self):
+        path = self.translate_path(self.path)
+        header = self.headers.get('Range', '')
+        if not header.startswith('bytes=') or not os.path.isfile(path):
+            return super().send_head()
+        
+        size = os.path.getsize(path)
+        first, _, last = header[len('bytes='):].split(',')[0].strip().partition('-')
+        if not first:
+            # Suffix range - the last N bytes
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        if start >= size:
+            self.send_error(416)
+            return None
+        
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.range_remaining = end - start + 1
+        return f
+    
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, 'range_remaining', None)
+        if remaining is None:
+            return super().copyfile(source, outputfile)
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_file_server(directory):
+    """Serve directory over HTTP on a free local port; returns the base URL"""
+    handler = functools.partial(RangeRequestHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def generate_media(media_dir, kind, duration, variant=0):
+    """Create (once) a synthetic media file; variants differ in content so they never share a cache entry"""
+    path = os.path.join(media_dir, f"{kind}_{duration}s_v{variant}.{kind}")
+    if os.path.exists(path):
+        return path
+    
+    config = MEDIA_TYPES[kind]
+    cmd = ['ffmpeg', '-y', '-v', 'error']
+    if config['video']:
+        cmd.extend(['-f', 'lavfi', '-i', f"testsrc2=size=640x360:rate=25:duration={duration}"])
+    cmd.extend(['-f', 'lavfi', '-i', f"sine=frequency={220 + 20 * variant}:sample_rate=44100:duration={duration}"])
+    cmd.extend(config['args'] + ['-shortest', path])
+    subprocess.run(cmd, check=True, capture_output=True)
+    return path
+
+def process_tree():
+    """PIDs of this process and all of its live descendants (Linux /proc)"""
+    pids = [os.getpid()]
+    index = 0
+    while index < len(pids):
+        try:
+            with open(f"/proc/{pids[index]}/task/{pids[index]}/children") as f:
+                pids.extend(int(pid) for pid in f.read().split())
+        except OSError:
+            pass
+        index += 1
+    return pids
+
+def read_proc_field(pid, name, key):
+    """One numeric field from /proc/<pid>/<name>, or 0 if unavailable"""
+    try:
+        with open(f"/proc/{pid}/{name}") as f:
+            for line in f:
+                if line.startswith(key):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+def tree_io():
+    """(read_bytes, write_bytes) of the process tree - reaped children are included in ours"""
+    pids = process_tree()
+    return (sum(read_proc_field(pid, 'io', 'read_bytes:') for pid in pids),
+            sum(read_proc_field(pid, 'io', 'write_bytes:') for pid in pids))
+
+class ResourceSampler:
+    """Samples the process tree's total RSS in the background to find its peak"""
+    
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_kb = 0
+        self.running = False
+    
+    def sample(self):
+        rss = sum(read_proc_field(pid, 'status', 'VmRSS:') for pid in process_tree())
+        self.peak_kb = max(self.peak_kb, rss)
+    
+    def loop(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+    
+    def __enter__(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+        self.sample()
+        if not self.peak_kb:
+            # No /proc - fall back to the largest single process
+            self.peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def wait_for_job(client, job):
+    """Poll a job until it finishes, then download its result; raises if it failed"""
+    while True:
+        status = client.get(job['status_url']).get_json()
+        if status['status'] == 'failed':
+            raise Exception(status.get('error') or 'Conversion failed')
+        if status['status'] == 'done':
+            break
+        time.sleep(0.05)
+    response = client.get(job['result_url'])
+    size = len(response.data)
+    response.close()
+    return size
+
+def make_operation(app, scenario, kind, duration, bench, index):
+    """Build the zero-argument callable for one timed operation"""
+    work_dir = bench['work_dir']
+    trim_start, trim_end = duration * 0.25, duration * 0.75
+    
+    if scenario == 'trim':
+        source = generate_media(bench['media_dir'], kind, duration)
+        output = os.path.join(work_dir, f"trim_{index}.mp4")
+        return lambda: app.trim_video(source, output, trim_start, trim_end)
+    
+    if scenario == 'mp3':
+        source = generate_media(bench['media_dir'], kind, duration)
+        output = os.path.join(work_dir, f"mp3_{index}.mp3")
+        return lambda: app.convert_to_mp3_ffmpeg(source, output)
+    
+    if scenario == 'fallback':
+        source = generate_media(bench['media_dir'], kind, duration)
+        output = os.path.join(work_dir, f"fallback_{index}.mp3")
+        return lambda: app.convert_to_mp3_streaming(source, output)
+    
+    if scenario == 'id3':
+        source = generate_media(bench['media_dir'], kind, duration)
+        output = os.path.join(work_dir, f"id3_{index}.mp3")
+        shutil.copyfile(source, output)
+        return lambda: app.add_id3_tags(output, title='Benchmark', artist='Synthetic', album='lavfi',
+                                        genre='Test', track='1', year='2024', comment='benchmark run')
+    
+    if scenario == 'upload':
+        # A distinct file per operation so every upload is a cold conversion
+        source = generate_media(bench['media_dir'], kind, duration, variant=index + 1)
+        
+        def upload():
+            client = app.app.test_client()
+            with open(source, 'rb') as f:
+                response = client.post('/convert', data={
+                    'input_type': 'file', 'output_format': 'mp3', 'meta_title': 'Benchmark',
+                    'video': (f, os.path.basename(source)),
+                }, content_type='multipart/form-data')
+            if response.status_code != 202:
+                raise Exception(response.get_json().get('error'))
+            return wait_for_job(client, response.get_json())
+        return upload
+    
+    if scenario == 'url':
+        source = generate_media(bench['media_dir'], kind, duration, variant=index + 1)
+        url = f"{bench['server']}/{os.path.basename(source)}"
+        
+        def convert_url():
+            client = app.app.test_client()
+            response = client.post('/convert', data={
+                'input_type': 'url', 'video_url': url, 'output_format': 'mp3',
+                'start_time': str(trim_start), 'end_time': str(trim_end),
+            })
+            if response.status_code != 202:
+                raise Exception(response.get_json().get('error'))
+            return wait_for_job(client, response.get_json())
+        return convert_url
+    
+    raise Exception(f"Unknown scenario '{scenario}'")
+
+def clear_caches(app):
+    """Empty the app's disk caches so every round measures cold conversions"""
+    folders = [tier['folder'] for tier in app.CACHE_TIERS.values()] + [app.INFO_CACHE_FOLDER]
+    for folder in folders:
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if os.path.isfile(path):
+                os.remove(path)
+
+def run_case(app, scenario, kind, duration, concurrency, iterations, bench):
+    """Run iterations rounds of `concurrency` parallel operations and summarise them"""
+    latencies = []
+    errors = []
+    operations = concurrency * iterations
+    calls = [make_operation(app, scenario, kind, duration, bench, index) for index in range(operations)]
+    
+    def timed(call):
+        started = time.perf_counter()
+        try:
+            call()
+        except Exception as e:
+            errors.append(str(e))
+            return
+        latencies.append(time.perf_counter() - started)
+    
+    read_before, write_before = tree_io()
+    with ResourceSampler() as sampler, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        for round_index in range(iterations):
+            clear_caches(app)
+            list(pool.map(timed, calls[round_index * concurrency:(round_index + 1) * concurrency]))
+        elapsed = time.perf_counter() - started
+    read_after, write_after = tree_io()
+    
+    result = {
+        'scenario': scenario,
+        'media': kind,
+        'duration': duration,
+        'concurrency': concurrency,
+        'operations': operations,
+        'errors': len(errors),
+        'throughput': round(len(latencies) / elapsed, 3) if elapsed else 0,
+        'peak_rss_mb': round(sampler.peak_kb / 1024, 1),
+        'disk_read_mb': round((read_after - read_before) / 1024 / 1024, 2),
+        'disk_write_mb': round((write_after - write_before) / 1024 / 1024, 2),
+    }
+    if latencies:
+        for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            result[name] = round(percentile(latencies, fraction), 4)
+    if errors:
+        result['first_error'] = errors[0][:200]
+    return result
+
+def case_key(result):
+    """Stable identifier of a benchmark case, used to match baseline entries"""
+    return f"{result['scenario']}/{result['media']}/{result['duration']}s/c{result['concurrency']}"
+
+def format_report(results, baseline=None):
+    """Human-readable table, with change against the baseline when one is given"""
+    header = f"{'case':<28} {'ops/s':>8} {'p50 s':>8} {'p90 s':>8} {'p99 s':>8} {'rss MB':>8} {'rd MB':>8} {'wr MB':>8} {'err':>4}"
+    if baseline:
+        header += f" {'d p50':>8} {'d ops/s':>8}"
+    lines = [header, '-' * len(header)]
+    for result in results:
+        line = (f"{case_key(result):<28} {result['throughput']:>8} {result.get('p50', '-'):>8} "
+                f"{result.get('p90', '-'):>8} {result.get('p99', '-'):>8} {result['peak_rss_mb']:>8} "
+                f"{result['disk_read_mb']:>8} {result['disk_write_mb']:>8} {result['errors']:>4}")
+        previous = (baseline or {}).get(case_key(result))
+        if previous and previous.get('p50') and result.get('p50') and previous['throughput']:
+            line += (f" {(result['p50'] / previous['p50'] - 1) * 100:>+7.1f}%"
+                     f" {(result['throughput'] / previous['throughput'] - 1) * 100:>+7.1f}%")
+        lines.append(line)
+        if result.get('first_error'):
+            lines.append(f"    error: {result['first_error']}")
+    return '\n'.join(lines)
+
+def find_regressions(results, baseline, threshold):
+    """Cases whose p50 latency rose, or throughput fell, by more than threshold"""
+    regressions = []
+    for result in results:
+        previous = baseline.get(case_key(result))
+        if not previous or not previous.get('p50') or not result.get('p50'):
+            continue
+        if result['p50'] > previous['p50'] * (1 + threshold):
+            regressions.append(f"{case_key(result)}: p50 {previous['p50']}s -> {result['p50']}s")
+        if result['throughput'] < previous['throughput'] * (1 - threshold):
+            regressions.append(f"{case_key(result)}: throughput {previous['throughput']} -> {result['throughput']} ops/s")
+    return regressions
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the video converter on synthetic local media")
+    parser.add_argument('--scenarios', default=DEFAULT_SCENARIOS,
+                        help=f"comma-separated, from: {', '.join(SCENARIOS)} (default: {DEFAULT_SCENARIOS})")
+    parser.add_argument('--media', default='', help="limit to these media types (comma-separated)")
+    parser.add_argument('--durations', default='10,60', help="source durations in seconds (default: 10,60)")
+    parser.add_argument('--concurrency', default='1,4', help="parallel operations per round (default: 1,4)")
+    parser.add_argument('--iterations', type=int, default=3, help="rounds per case (default: 3)")
+    parser.add_argument('--work-dir', help="keep generated media and app state here instead of a temp dir")
+    parser.add_argument('--output', default='bench_output.txt', help="where to write the text report")
+    parser.add_argument('--json', help="also write raw results as JSON to this file")
+    parser.add_argument('--save-baseline', help="save results as a baseline JSON file")
+    parser.add_argument('--baseline', help="compare against a saved baseline; exit 1 on regression")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"relative change that counts as a regression (default: {DEFAULT_THRESHOLD})")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            sys.exit(f"Unknown scenario '{scenario}'. Choose from: {', '.join(SCENARIOS)}")
+    media_filter = {m.strip() for m in args.media.split(',') if m.strip()}
+    durations = [int(d) for d in args.durations.split(',') if d.strip()]
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    
+    root = args.work_dir or tempfile.mkdtemp(prefix='converter_bench_')
+    media_dir = os.path.join(root, 'media')
+    work_dir = os.path.join(root, 'work')
+    app_tmp = os.path.join(root, 'tmp')
+    for folder in (media_dir, work_dir, app_tmp):
+        os.makedirs(folder, exist_ok=True)
+    
+    # The app keeps all of its state under the temp dir - point it at ours, and
+    # switch off rate limiting and the janitor so they can't skew the numbers
+    os.environ['TMPDIR'] = app_tmp
+    tempfile.tempdir = None
+    os.environ.setdefault('RATE_LIMIT_PER_MINUTE', '0')
+    os.environ.setdefault('JANITOR_INTERVAL', '0')
+    os.environ.setdefault('DISK_HIGH_WATER', '1.01')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+    
+    bench = {'media_dir': media_dir, 'work_dir': work_dir, 'server': start_file_server(media_dir)}
+    results = []
+    try:
+        for scenario in scenarios:
+            for kind in SCENARIOS[scenario]:
+                if media_filter and kind not in media_filter:
+                    continue
+                for duration in durations:
+                    for concurrency in levels:
+                        result = run_case(app, scenario, kind, duration, concurrency, args.iterations, bench)
+                        results.append(result)
+                        print(format_report([result]).splitlines()[-1], flush=True)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(root, ignore_errors=True)
+    
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {case_key(r): r for r in json.load(f)['results']}
+    
+    report = format_report(results, baseline)
+    print()
+    print(report)
+    with open(args.output, 'w') as f:
+        f.write(report + '\n')
+    
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump({'created': time.time(), 'results': results}, f, indent=2)
+    
+    if baseline:
+        regressions = find_regressions(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+# gunicorn settings (the Dockerfile runs `gunicorn -c gunicorn.conf.py app:app`)
+import os
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+timeout = 300
+# Threaded workers so long-lived progress streams and live downloads
+# don't each hold a whole worker process. Progress streams and batch ZIPs
+# may take at most MAX_STREAMS (app.py) of each worker's threads.
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = 8
+
+# Set STARTUP_PROFILE to a path prefix to write a cProfile of each worker's
+# start-up (app import plus warm-up) to <prefix>.<pid>
+STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE')
+
+def post_fork(server, worker):
+    """Import the app and warm up yt-dlp in each new worker before it takes requests"""
+    profiler = None
+    if STARTUP_PROFILE:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    
+    started = time.perf_counter()
+    import app
+    timings = [('import app', time.perf_counter() - started)]
+    timings.extend(app.warm_up())
+    
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(f"{STARTUP_PROFILE}.{worker.pid}")
+    server.log.info(f"Worker {worker.pid} warmed up: " +
+                    ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in timings))
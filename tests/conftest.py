@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Keep the app's jobs, cache and scratch folders out of the real temp directory. TMPDIR rather
+# than tempfile.tempdir alone, so the pool's worker processes use the same folders.
+os.environ['TMPDIR'] = tempfile.mkdtemp(prefix='converter_tests_')
+tempfile.tempdir = os.environ['TMPDIR']
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+"""Admission control - the per-client token bucket and the checks /convert runs before any real work."""
+import io
+
+import pytest
+
+import app
+
+@pytest.fixture(autouse=True)
+def rate_limit(monkeypatch, tmp_path):
+    # 60 units a minute is one per second, which keeps the waits easy to check
+    monkeypatch.setattr(app, 'RATE_LIMIT_PER_MINUTE', 60)
+    monkeypatch.setattr(app, 'RATE_LIMIT_BURST', 10)
+    monkeypatch.setattr(app, 'RATE_FILE', str(tmp_path / 'rate_limits.json'))
+
+def test_bucket_grants_up_to_burst_then_waits():
+    assert app.take_tokens('client', 6) == 0
+    assert app.take_tokens('client', 4) == 0
+    wait = app.take_tokens('client', 3)
+    assert 2.9 < wait <= 3
+    # A refused request isn't charged, and buckets are per client
+    assert app.take_tokens('other', 10) == 0
+
+def test_cost_above_burst_is_paid_off_not_capped():
+    # Work bigger than the bucket needs a full one...
+    assert app.take_tokens('client', 1) == 0
+    assert 0 < app.take_tokens('client', 25) <= 1
+    app.take_tokens('client', -1)
+    assert app.take_tokens('client', 25) == 0
+    # ...and leaves the client owing the rest: 15 units plus the next request's own cost
+    wait = app.take_tokens('client', 1)
+    assert 15.9 < wait <= 16
+
+def test_refund_returns_units():
+    assert app.take_tokens('client', 10) == 0
+    app.take_tokens('client', -4)
+    assert app.take_tokens('client', 4) == 0
+    assert app.take_tokens('client', 1) > 0
+
+def test_convert_refuses_before_reading_the_upload(monkeypatch):
+    app.take_tokens('127.0.0.1', 10)
+    monkeypatch.setattr(app, 'conversion_params', pytest.fail)
+    monkeypatch.setattr(app, 'get_video_info', pytest.fail)
+
+    client = app.app.test_client()
+    response = client.post('/convert', data={'input_type': 'file', 'video': (io.BytesIO(b'x' * 4096), 'v.mp4')})
+    assert response.status_code == 429
+    assert response.headers['Retry-After']
+    response = client.post('/convert', data={'input_type': 'url', 'video_url': 'https://example.com/v'})
+    assert response.status_code == 429
+
+def test_convert_looks_up_duration_only_once_admitted(monkeypatch):
+    lookups = []
+    monkeypatch.setattr(app, 'get_video_info', lambda url: lookups.append(url) or {'duration': 120})
+    monkeypatch.setattr(app, 'submit_job', lambda params, cost=1: (lookups.append(cost), 'a' * 32)[1])
+
+    client = app.app.test_client()
+    response = client.post('/convert', data={'input_type': 'url', 'video_url': 'https://example.com/v'})
+    assert response.status_code == 202
+    # Two minutes of MP3 - the provisional unit is topped up to the real price
+    assert lookups == ['https://example.com/v', 2.0]
+    assert app.take_tokens('127.0.0.1', 8) == 0
+    assert app.take_tokens('127.0.0.1', 1) > 0
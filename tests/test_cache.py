@@ -0,0 +1,45 @@
+"""Cache tiers and the info cache - eviction, expiry and the janitor's pruning."""
+import os
+import time
+
+import app
+
+def put(tier, key, data, age=0):
+    path = os.path.join(app.SCRATCH_FOLDER, f"{key}.bin")
+    with open(path, 'wb') as f:
+        f.write(data)
+    entry = app.cache_put(tier, key, path, title=key)
+    then = time.time() - age
+    os.utime(entry['path'], (then, then))
+    return entry
+
+def test_evict_cache_drops_least_recently_used():
+    app.evict_cache('result', 0)
+    put('result', 'old', b'x' * 100, age=300)
+    put('result', 'newer', b'x' * 100, age=100)
+    put('result', 'newest', b'x' * 100)
+
+    # Reading an entry makes it the most recently used
+    assert app.cache_get('result', 'old') is not None
+    app.evict_cache('result', 200)
+
+    assert app.cache_get('result', 'newer') is None
+    assert app.cache_get('result', 'old') is not None
+    assert app.cache_get('result', 'newest') is not None
+    assert not os.path.exists(os.path.join(app.CACHE_TIERS['result']['folder'], 'newer.json'))
+
+def test_janitor_prunes_expired_video_info():
+    fresh, stale = 'https://example.com/fresh', 'https://example.com/stale'
+    for url in (fresh, stale):
+        with open(app.info_cache_path(url), 'w') as f:
+            f.write('{"title": "t"}')
+    then = time.time() - app.INFO_CACHE_TTL - 60
+    os.utime(app.info_cache_path(stale), (then, then))
+
+    assert app.cached_video_info(stale) is None
+    assert app.fresh_info_entries() == 1
+
+    app.clean_temp_files()
+    assert os.path.exists(app.info_cache_path(fresh))
+    assert not os.path.exists(app.info_cache_path(stale))
+    assert app.cached_video_info(fresh) == {'title': 't'}
@@ -0,0 +1,44 @@
+"""Job records left behind - queued and running jobs whose process has exited are failed, live ones kept."""
+import os
+import subprocess
+import sys
+
+import app
+
+def in_exited_process(code):
+    """Run code against the app in a process that exits without cleaning up, and return what it prints"""
+    script = f"import os, app\n{code}\nos._exit(0)\n"
+    result = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(app.__file__)),
+                            capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+def test_jobs_of_an_exited_process_are_failed():
+    queued = in_exited_process("print(app.create_job({}))")
+    running = in_exited_process(
+        "job_id = app.create_job({})\n"
+        "lock = app.running_job(job_id)\n"
+        "lock.__enter__()\n"
+        "app.update_job(job_id, status='running', progress={'stage': 'waiting', 'waiting_for': 'encode'})\n"
+        "print(job_id)"
+    )
+    owner = app.load_job(queued)['owner']
+
+    app.fail_orphaned_jobs()
+    for job_id in (queued, running):
+        job = app.load_job(job_id)
+        assert job['status'] == 'failed'
+        assert 'restarted' in job['error']
+        assert not os.path.exists(job['scratch_dir'])
+    assert not os.path.exists(app.owner_lock_path(owner))
+    assert not os.path.exists(app.job_lock_path(running))
+
+def test_jobs_of_live_processes_are_kept():
+    queued = app.create_job({})
+    running = app.create_job({})
+    with app.running_job(running):
+        app.update_job(running, status='running')
+        app.fail_orphaned_jobs()
+        assert app.load_job(running)['status'] == 'running'
+    assert app.load_job(queued)['status'] == 'queued'
+    assert os.path.exists(app.owner_lock_path(app.job_owner()))
+    assert not os.path.exists(app.job_lock_path(running))
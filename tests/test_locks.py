@@ -0,0 +1,95 @@
+"""Cross-process locks - the shared stats and the work slots must be free again once released,
+whatever the job pool does in the meantime."""
+import os
+import shutil
+import threading
+import subprocess
+
+import pytest
+
+import app
+
+@pytest.fixture
+def pool():
+    yield app.get_executor
+    executor, app._executor = app._executor, None
+    if executor is not None:
+        # Kill rather than wait - a worker stuck on a lock would never finish
+        for process in list(executor._processes.values()):
+            process.kill()
+        executor.shutdown()
+
+def test_stats_lock_not_kept_by_pool_workers(pool):
+    # A request thread is inside increment_stat while the pool starts its workers
+    entered, release = threading.Event(), threading.Event()
+
+    def hold_stats():
+        with app.locked_stats():
+            entered.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold_stats)
+    holder.start()
+    entered.wait()
+    assert pool().submit(os.getpid).result(timeout=60) != os.getpid()
+    release.set()
+    holder.join()
+
+    # A worker that had copied the lock would block here forever
+    pool().submit(app.increment_stat, 'test_lock_counter').result(timeout=30)
+    app.increment_stat('test_lock_counter')
+    assert app.read_stats()['test_lock_counter'] == 2
+
+@pytest.fixture
+def one_encode_slot(monkeypatch):
+    monkeypatch.setitem(app.WORK_SLOTS, 'encode', 1)
+
+def slot_is_free(kind):
+    handle = app.acquire_slot(kind, wait=False)
+    if handle is None:
+        return False
+    handle.close()
+    return True
+
+def test_slot_released_on_close(one_encode_slot):
+    held = app.acquire_slot('encode')
+    assert not slot_is_free('encode')
+    held.close()
+    assert slot_is_free('encode')
+
+def test_slot_not_kept_by_pool_workers(one_encode_slot, pool):
+    # A request thread holds the encode slot while the pool starts its workers
+    held = app.acquire_slot('encode')
+    pool().submit(os.getpid).result(timeout=60)
+    held.close()
+    assert pool().submit(slot_is_free, 'encode').result(timeout=30)
+    assert slot_is_free('encode')
+
+def test_live_refuses_before_fetching_when_encoders_are_busy(one_encode_slot, monkeypatch):
+    monkeypatch.setattr(app, 'RATE_LIMIT_PER_MINUTE', 0)
+    monkeypatch.setattr(app, 'get_video_info', lambda url: {'duration': 60})
+    for name in ('find_source', 'get_audio_stream_url', 'fetch_source'):
+        monkeypatch.setattr(app, name, pytest.fail)
+
+    held = app.acquire_slot('encode')
+    try:
+        response = app.app.test_client().get('/convert/live', query_string={'video_url': 'https://example.com/v'})
+        assert response.status_code == 429
+    finally:
+        held.close()
+
+def test_live_stream_gives_its_slot_back(one_encode_slot, monkeypatch, tmp_path):
+    if not shutil.which('ffmpeg'):
+        pytest.skip("ffmpeg is required")
+    source = str(tmp_path / 'tone.wav')
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'sine=duration=2', source], check=True)
+    monkeypatch.setattr(app, 'RATE_LIMIT_PER_MINUTE', 0)
+    monkeypatch.setattr(app, 'get_video_info', lambda url: {'duration': 2})
+    monkeypatch.setattr(app, 'find_source', lambda url, media: {'path': source, 'title': 'tone'})
+
+    response = app.app.test_client().get('/convert/live', query_string={'video_url': 'https://example.com/tone'})
+    assert response.status_code == 200
+    assert not slot_is_free('encode')
+    assert len(response.get_data()) > 0
+    response.close()
+    assert slot_is_free('encode')
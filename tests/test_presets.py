@@ -0,0 +1,33 @@
+"""Encoder preset settings - checked at import, and the page offers exactly the allowed presets."""
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+import app
+
+def import_app(**env):
+    return subprocess.run([sys.executable, '-c', 'import app'], env=dict(os.environ, **env),
+                          cwd=os.path.dirname(os.path.abspath(app.__file__)), capture_output=True, text=True)
+
+@pytest.mark.parametrize('env', [
+    {'ENCODER_PRESET': 'bogus'},
+    {'ALLOWED_PRESETS': 'fast,bogus'},
+    {'ENCODER_PRESET': 'archival', 'ALLOWED_PRESETS': 'fast,balanced'},
+])
+def test_bad_preset_settings_fail_at_import(env):
+    result = import_app(**env)
+    assert result.returncode != 0
+    assert 'preset' in result.stderr.lower()
+
+def test_page_offers_the_allowed_presets(monkeypatch):
+    monkeypatch.setattr(app, 'ALLOWED_PRESETS', ['fast', 'archival'])
+    monkeypatch.setattr(app, 'DEFAULT_PRESET', 'archival')
+    page = app.app.test_client().get('/').get_data(as_text=True)
+
+    for select in ('file_preset', 'preset'):
+        options = re.search(rf'<select[^>]*id="{select}"[^>]*>(.*?)</select>', page, re.S).group(1)
+        assert re.findall(r'<option value="(\w+)"', options) == ['fast', 'archival']
+        assert re.findall(r'<option value="(\w+)" selected', options) == ['archival']
@@ -0,0 +1,50 @@
+"""Download progress - yt-dlp's hooks must reach the job's reporter from whichever thread calls them."""
+import functools
+import http.server
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+import app
+
+class RecordingReporter(app.ProgressReporter):
+    def __init__(self, job_id):
+        super().__init__(job_id)
+        self.threads = set()
+
+    def update(self, stage=None, **fields):
+        self.threads.add(threading.current_thread())
+        super().update(stage, **fields)
+
+@pytest.fixture
+def hls_url(tmp_path):
+    if not shutil.which('ffmpeg'):
+        pytest.skip("ffmpeg is required")
+    # Six one-second segments, fetched FRAGMENT_THREADS at a time
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'sine=duration=6', '-c:a', 'aac',
+                    '-f', 'hls', '-hls_time', '1', '-hls_list_size', '0', str(tmp_path / 'index.m3u8')], check=True)
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(tmp_path))
+    handler.func.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/index.m3u8"
+    server.shutdown()
+
+def test_fragment_progress_reaches_the_job(hls_url, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'FRAGMENT_THREADS', 4)
+    job_id = app.create_job({'scratch_dir': str(tmp_path)})
+    reporter = RecordingReporter(job_id)
+    app.set_progress_reporter(reporter)
+    try:
+        with app.pooled_ydl('audio', outtmpl=str(tmp_path / 'out.%(ext)s'), fixup='never') as ydl:
+            ydl.download([hls_url])
+    finally:
+        app.set_progress_reporter(None)
+
+    assert threading.current_thread() in reporter.threads
+    assert any(thread is not threading.current_thread() for thread in reporter.threads)
+    progress = app.load_job(job_id)['progress']
+    assert progress['stage'] == 'downloading'
+    assert progress['downloaded_bytes'] > 0
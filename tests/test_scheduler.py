@@ -0,0 +1,69 @@
+"""The job scheduler - cheaper jobs first, waiting time counted against cost, lost workers reported."""
+from concurrent.futures import Future
+
+import pytest
+
+import app
+
+class FakePool:
+    """Records what the scheduler hands out; each job runs until the test finishes its future"""
+
+    def __init__(self):
+        self.started = []
+
+    def submit(self, fn, job_id, params):
+        future = Future()
+        self.started.append((params['name'], future))
+        return future
+
+    def finish(self, name, error=None):
+        future = dict(self.started)[name]
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(app, 'MAX_WORKERS', 1)
+    monkeypatch.setattr(app, 'get_executor', lambda: pool)
+    monkeypatch.setattr(app, '_pending_jobs', [])
+    monkeypatch.setattr(app, '_running_jobs', 0)
+    return pool
+
+def started(pool):
+    return [name for name, _ in pool.started]
+
+def test_cheaper_jobs_go_first(pool):
+    app.submit_job({'name': 'first'}, cost=10)
+    for name, cost in (('long', 8), ('short', 1), ('medium', 3)):
+        app.submit_job({'name': name}, cost=cost)
+    assert started(pool) == ['first']
+    assert app.queued_cost() == 12
+
+    for name in ('first', 'short', 'medium'):
+        pool.finish(name)
+    assert started(pool) == ['first', 'short', 'medium', 'long']
+    assert app.queued_cost() == 0
+
+def test_waiting_counts_against_cost(pool, monkeypatch):
+    monkeypatch.setattr(app, 'PRIORITY_AGING', 10)
+    app.submit_job({'name': 'first'}, cost=1)
+    app.submit_job({'name': 'long'}, cost=5)
+    # Queued 60 s ago - six units of waiting outweigh the four it costs more
+    app._pending_jobs[0] = (5, app._pending_jobs[0][1] - 60) + app._pending_jobs[0][2:]
+    app.submit_job({'name': 'short'}, cost=1)
+
+    pool.finish('first')
+    assert started(pool) == ['first', 'long']
+
+def test_lost_worker_fails_the_job_and_frees_its_place(pool):
+    job_id = app.submit_job({'name': 'crashed'}, cost=1)
+    app.submit_job({'name': 'next'}, cost=1)
+    pool.finish('crashed', error=RuntimeError("worker killed"))
+
+    job = app.load_job(job_id)
+    assert job['status'] == 'failed'
+    assert 'stopped unexpectedly' in job['error']
+    assert started(pool) == ['crashed', 'next']
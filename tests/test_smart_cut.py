@@ -0,0 +1,53 @@
+"""Frame accuracy of smart_cut_video - the cut must show exactly the source frames in [start, end)."""
+import shutil
+import subprocess
+
+import pytest
+
+import app
+
+pytestmark = pytest.mark.skipif(not (shutil.which('ffmpeg') and shutil.which('ffprobe')),
+                                reason="ffmpeg and ffprobe are required")
+
+# 25 fps with a keyframe every 2 s and B-frames, so the head and tail are re-encoded partial GOPs
+FRAME_RATE = 25
+GOP_SECONDS = 2
+
+def make_source(path, bframes):
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=size=320x240:rate={FRAME_RATE}:duration=20",
+        '-f', 'lavfi', '-i', 'sine=frequency=440:duration=20',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(FRAME_RATE * GOP_SECONDS),
+        '-bf', str(bframes), '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', path,
+    ]
+    subprocess.run(cmd, check=True)
+
+def frame_md5s(path, *input_args):
+    """MD5 of every decoded video frame, in presentation order"""
+    cmd = ['ffmpeg', '-v', 'error'] + list(input_args) + ['-i', path, '-map', '0:v', '-f', 'framemd5', '-']
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return [line.rsplit(',', 1)[-1].strip() for line in output.splitlines() if line and not line.startswith('#')]
+
+@pytest.mark.parametrize('bframes', [0, 2, 3])
+def test_smart_cut_matches_reference(tmp_path, bframes):
+    source = str(tmp_path / 'source.mp4')
+    output = str(tmp_path / 'cut.mp4')
+    make_source(source, bframes)
+    start, end = 4.3, 15.7
+
+    assert app.smart_cut_video(source, output, start, end)
+
+    # Reference: an accurate decode of the same range straight from the source
+    reference = frame_md5s(source, '-ss', str(start), '-t', str(end - start))
+    cut = frame_md5s(output)
+    assert len(cut) == len(reference)
+
+    # The stream-copied middle (keyframe at 6 s up to the one at 14 s) decodes bit-exact, and must
+    # sit at the same positions as in the reference - a repeated or dropped frame at the head
+    # shifts it. Re-encoded head and tail frames never match anything in the source.
+    source_frames = set(reference)
+    copied = [index for index, md5 in enumerate(cut) if md5 in source_frames]
+    assert len(copied) == (14 - 6) * FRAME_RATE
+    assert all(cut[index] == reference[index] for index in copied)
+    assert copied == list(range(copied[0], copied[0] + len(copied)))
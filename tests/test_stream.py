@@ -0,0 +1,54 @@
+"""Streaming ingestion - ffmpeg fed from an upload while it is still arriving."""
+import io
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import app
+
+pytestmark = pytest.mark.skipif(not shutil.which('ffmpeg'), reason="ffmpeg is required")
+
+def make_wav(path, *tones):
+    """Ten seconds of WAV: a shared 440 Hz opening, then a tone that tells the files apart"""
+    inputs = []
+    for frequency, duration in tones:
+        inputs.extend(['-f', 'lavfi', '-i', f"sine=frequency={frequency}:duration={duration}"])
+    cmd = ['ffmpeg', '-v', 'error', '-y'] + inputs
+    cmd.extend(['-filter_complex', f"concat=n={len(tones)}:v=0:a=1", path])
+    subprocess.run(cmd, check=True)
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_trimmed_uploads_with_the_same_start_get_their_own_cache_entries(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'UPLOAD_CHUNK_SIZE', 16 * 1024)
+    app.evict_cache('result', 0)
+    uploads = [make_wav(str(tmp_path / f"{frequency}.wav"), (440, 6), (frequency, 4)) for frequency in (660, 880)]
+    assert uploads[0][:500000] == uploads[1][:500000] and uploads[0] != uploads[1]
+
+    before = app.read_stats().get('bytes_in_upload', 0)
+    for data in uploads:
+        params = {'input_type': 'file', 'upload_name': 'tone.wav', 'start_time': None, 'end_time': 1,
+                  'preset': app.DEFAULT_PRESET, 'meta': {}, 'scratch_dir': app.make_scratch_dir()}
+        job_id = app.create_job(params)
+        stream = io.BytesIO(data)
+        app.stream_conversion(job_id, params, stream.read(app.UPLOAD_CHUNK_SIZE), stream)
+        assert app.load_job(job_id)['status'] == 'done'
+
+    assert len(app.cache_usage('result')) == 2
+    assert app.read_stats()['bytes_in_upload'] - before == sum(len(data) for data in uploads)
+
+def test_run_ffmpeg_stops_ffmpeg_when_the_input_fails(monkeypatch):
+    started = []
+    popen = subprocess.Popen
+    monkeypatch.setattr(subprocess, 'Popen', lambda *args, **kwargs: started.append(popen(*args, **kwargs)) or started[-1])
+
+    def disconnecting_client():
+        yield b'\0' * 65536
+        raise OSError("client went away")
+
+    cmd = ['ffmpeg', '-f', 's16le', '-ar', '8000', '-ac', '1', '-i', 'pipe:0', '-f', 'null', '-']
+    with pytest.raises(OSError):
+        app.run_ffmpeg(cmd, timeout=30, input_chunks=disconnecting_client())
+    assert started[0].returncode is not None
@@ -0,0 +1,45 @@
+"""Long-lived responses - progress streams and batch ZIPs share MAX_STREAMS request threads per worker."""
+import threading
+
+import pytest
+
+import app
+
+@pytest.fixture(autouse=True)
+def one_stream(monkeypatch):
+    monkeypatch.setattr(app, 'RATE_LIMIT_PER_MINUTE', 0)
+    monkeypatch.setattr(app, '_stream_slots', threading.BoundedSemaphore(1))
+
+def test_event_streams_are_limited_and_give_their_slot_back(tmp_path):
+    job_id = app.create_job({'scratch_dir': str(tmp_path)})
+    client = app.app.test_client()
+
+    first = client.get(f"/jobs/{job_id}/events")
+    assert first.status_code == 200
+    second = client.get(f"/jobs/{job_id}/events")
+    assert second.status_code == 429
+    assert second.headers['Retry-After']
+
+    first.close()
+    third = client.get(f"/jobs/{job_id}/events")
+    assert third.status_code == 200
+    third.close()
+
+def test_batch_refused_before_submitting_jobs(monkeypatch):
+    monkeypatch.setattr(app, 'submit_job', pytest.fail)
+    release = app.take_stream_slot()
+    try:
+        response = app.app.test_client().post('/convert/batch', json={'urls': ['https://example.com/v']})
+        assert response.status_code == 429
+    finally:
+        release()
+    assert app.take_stream_slot() is not None
+
+def test_failed_batch_gives_its_slot_back(monkeypatch):
+    def refuse(params, cost=1):
+        raise Exception("Job queue unavailable")
+    monkeypatch.setattr(app, 'submit_job', refuse)
+
+    response = app.app.test_client().post('/convert/batch', json={'urls': ['https://example.com/v']})
+    assert response.status_code == 400
+    assert app.take_stream_slot() is not None
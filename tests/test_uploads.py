@@ -0,0 +1,76 @@
+"""Resumable uploads and ranged result downloads - both ends of a transfer survive a dropped connection."""
+import os
+
+import pytest
+
+import app
+
+DATA = bytes(range(256)) * 400
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, 'RATE_LIMIT_PER_MINUTE', 0)
+    return app.app.test_client()
+
+def put(client, upload, start, end):
+    return client.put(upload['upload_url'], data=DATA[start:end + 1],
+                      headers={'Content-Range': f"bytes {start}-{end}/{len(DATA)}"})
+
+def test_upload_resumes_from_what_arrived(client, monkeypatch):
+    queued = []
+    monkeypatch.setattr(app, 'submit_job', lambda params, cost=1: (queued.append(params), 'a' * 32)[1])
+    response = client.post('/uploads', json={'filename': 'clip.mp4', 'size': len(DATA)})
+    assert response.status_code == 201
+    upload = response.get_json()
+
+    assert put(client, upload, 0, 40959).get_json()['received'] == 40960
+    # A gap is refused with the offset to carry on from
+    response = put(client, upload, 60000, len(DATA) - 1)
+    assert response.status_code == 409
+    assert response.get_json()['received'] == 40960
+    # Not finished yet
+    assert client.post(upload['finalize_url']).status_code == 409
+
+    # Resuming may resend bytes the server already has
+    assert client.get(upload['upload_url']).get_json()['received'] == 40960
+    assert put(client, upload, 30000, len(DATA) - 1).get_json()['received'] == len(DATA)
+
+    assert client.post(upload['finalize_url'], data={'output_format': 'mp3'}).status_code == 202
+    with open(queued[0]['upload_path'], 'rb') as f:
+        assert f.read() == DATA
+    # A repeated finalize can't queue the upload twice
+    assert client.post(upload['finalize_url']).status_code == 404
+
+def test_chunk_must_match_its_content_range(client):
+    upload = client.post('/uploads', json={'filename': 'clip.mp4', 'size': len(DATA)}).get_json()
+    response = client.put(upload['upload_url'], data=DATA[:100], headers={'Content-Range': f"bytes 0-199/{len(DATA)}"})
+    assert response.status_code == 400
+    response = client.put(upload['upload_url'], data=DATA[:100], headers={'Content-Range': 'bytes 0-99/100'})
+    assert response.status_code == 400
+
+@pytest.fixture
+def result_url(tmp_path):
+    path = tmp_path / 'result.mp3'
+    path.write_bytes(DATA)
+    job_id = app.create_job({'scratch_dir': str(tmp_path)})
+    app.update_job(job_id, status='done', output_path=str(path), download_filename='result.mp3', mimetype='audio/mpeg')
+    return f"/jobs/{job_id}/result", path
+
+def test_result_download_resumes_with_range(client, result_url):
+    url, path = result_url
+    full = client.get(url)
+    assert full.status_code == 200
+    assert full.headers['Accept-Ranges'] == 'bytes'
+    etag = full.headers['ETag']
+
+    resumed = client.get(url, headers={'Range': 'bytes=1000-', 'If-Range': etag})
+    assert resumed.status_code == 206
+    assert resumed.headers['Content-Range'] == f"bytes 1000-{len(DATA) - 1}/{len(DATA)}"
+    assert full.get_data()[:1000] + resumed.get_data() == DATA
+
+    # A changed file sends everything again rather than splicing two versions
+    path.write_bytes(DATA[::-1])
+    os.utime(path, (1, 1))
+    restarted = client.get(url, headers={'Range': 'bytes=1000-', 'If-Range': etag})
+    assert restarted.status_code == 200
+    assert restarted.get_data() == DATA[::-1]